@@ -1,17 +1,101 @@
+import calendar
 import logging
 import os
-import ujson as json
+import threading
 import ydb
-from typing import List
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor
+)
 
 logger = logging.getLogger()
 
 
+def timestamp_to_microseconds(timestamp) -> int:
+    """
+    Convert timestamp string in YDB format to microseconds since epoch,
+    since bulk upsert takes timestamps as numbers and doesn't cast strings
+    """
+
+    seconds = calendar.timegm((
+        int(timestamp[0:4]),
+        int(timestamp[5:7]),
+        int(timestamp[8:10]),
+        int(timestamp[11:13]),
+        int(timestamp[14:16]),
+        int(timestamp[17:19]),
+        0,
+        0,
+        0
+    ))
+
+    return seconds * 10**6 + int(timestamp[20:26])
+
+
+def execute_in_session(
+    session,
+    query,
+    parameters
+    ):
+    """
+    Execute query using session from pool checkout.
+    Defined once at module level instead of a closure created on every query.
+    Queries with parameters are built with declared parameters types,
+    so they are executed without preparing
+    """
+
+    return session.transaction().execute(
+        query=query,
+        parameters=parameters,
+        commit_tx=True
+    )
+
+
 class YDBClient:
     """
     Connection to Yandex Database
     """
 
+    __slots__ = (
+        'endpoint',
+        'database',
+        'users_table',
+        'likes_table',
+        'timetable_table',
+        'user_id_column',
+        'first_name_column',
+        'last_name_column',
+        'username_column',
+        'usage_column',
+        'data_column',
+        'meetings_ts_column',
+        'meetings_index',
+        'likes_from_column',
+        'likes_to_column',
+        'likes_link_column',
+        'start_column',
+        'end_column',
+        'camp_column',
+        'description_column',
+        'link_column',
+        'meetings_profile_keys',
+        'driver_timeout',
+        'pool_size',
+        'retry_settings',
+        'executor_workers',
+        'executor',
+        'upsert_user_queries',
+        'update_user_state_queries',
+        'meetings_profile_query',
+        'like_meetings_query',
+        'timetable_query',
+        'likes_path',
+        'likes_columns',
+        '_driver',
+        '_pool',
+        '_connection_lock'
+    )
+
     def __init__(self):
         self.endpoint = os.getenv('YDB_ENDPOINT')
         self.database = os.getenv('YDB_DATABASE')
@@ -34,9 +118,281 @@ class YDBClient:
         self.camp_column = 'camp'
         self.description_column = 'description'
         self.link_column = 'link'
+        self.meetings_profile_keys = (
+            'meetings_file_type',
+            'meetings_file_id',
+            'meetings_caption',
+            'meetings_ts'
+        )
         self.driver_timeout = 1
-        self.driver = self.create_driver()
-        self.pool = self.create_pool()
+        # Sessions needed is about requests per second times query latency,
+        # and a function instance processes just a few updates at once
+        self.pool_size = int(os.getenv('YDB_POOL_SIZE', '10'))
+        # Bound retries under throttling so they don't pile up load on the database
+        self.retry_settings = ydb.RetrySettings(
+            max_retries=5,
+            fast_backoff_settings=ydb.BackoffSettings(
+                ceiling=6,
+                slot_duration=0.005
+            ),
+            slow_backoff_settings=ydb.BackoffSettings(
+                ceiling=10,
+                slot_duration=0.01
+            )
+        )
+        self.executor_workers = 4
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_workers)
+        # Format queries once, so calls only bind the parameters
+        self.upsert_user_queries = self.create_upsert_user_queries()
+        self.update_user_state_queries = self.create_update_user_state_queries()
+        self.meetings_profile_query = self.create_meetings_profile_query()
+        self.like_meetings_query = self.create_like_meetings_query()
+        self.timetable_query = self.create_timetable_query()
+        # Likes are saved with bulk upsert, which writes rows without compiling a query
+        self.likes_path = f'{self.database}/{self.likes_table}'
+        self.likes_columns = (
+            ydb.BulkUpsertColumns()
+            .add_column(self.likes_from_column, ydb.OptionalType(ydb.PrimitiveType.Timestamp))
+            .add_column(self.likes_to_column, ydb.OptionalType(ydb.PrimitiveType.Timestamp))
+            .add_column(self.likes_link_column, ydb.OptionalType(ydb.PrimitiveType.Utf8))
+        )
+        # Connect on the first query instead of import, so invocations
+        # which don't use the database don't wait for the driver
+        self._driver = None
+        self._pool = None
+        self._connection_lock = threading.Lock()
+
+
+    @property
+    def driver(self) -> ydb.Driver:
+        """
+        Driver created on the first access
+        """
+
+        if self._driver is None:
+            with self._connection_lock:
+                if self._driver is None:
+                    self._driver = self.create_driver()
+
+        return self._driver
+
+
+    @property
+    def pool(self) -> ydb.SessionPool:
+        """
+        Session pool created on the first access
+        """
+
+        if self._pool is None:
+            # Create the driver before taking the lock since it takes the same lock
+            driver = self.driver
+
+            with self._connection_lock:
+                if self._pool is None:
+                    self._pool = self.create_pool(driver)
+
+        return self._pool
+
+
+    def create_upsert_user_queries(self) -> dict:
+        """
+        Build queries for upserting a user with every combination of optional
+        last name and username, keyed by their presence
+        """
+
+        queries = {}
+
+        for has_last_name in (False, True):
+            for has_username in (False, True):
+                columns_string = f'{self.user_id_column}, {self.first_name_column}'
+                values_string = '$user_id, $first_name'
+                declarations = 'DECLARE $user_id AS Uint64; DECLARE $first_name AS Utf8;'
+                parameters_types = {
+                    '$user_id': ydb.PrimitiveType.Uint64,
+                    '$first_name': ydb.PrimitiveType.Utf8
+                }
+
+                if has_last_name:
+                    columns_string += f', {self.last_name_column}'
+                    values_string += ', $last_name'
+                    declarations += ' DECLARE $last_name AS Utf8;'
+                    parameters_types['$last_name'] = ydb.PrimitiveType.Utf8
+
+                if has_username:
+                    columns_string += f', {self.username_column}'
+                    values_string += ', $username'
+                    declarations += ' DECLARE $username AS Utf8;'
+                    parameters_types['$username'] = ydb.PrimitiveType.Utf8
+
+                queries[(has_last_name, has_username)] = ydb.DataQuery(
+                    f"""
+                        {declarations}
+
+                        UPSERT INTO {self.users_table}
+                        ({columns_string})
+                        VALUES
+                        ({values_string})
+                    """,
+                    parameters_types
+                )
+
+        return queries
+
+
+    def create_update_user_state_queries(self) -> dict:
+        """
+        Build queries for incrementing user's usage and updating meetings timestamp,
+        keyed by meetings timestamp action:
+        None to keep it, True to set it and False to remove it
+        """
+
+        queries = {}
+
+        for set_meetings_ts in (None, False, True):
+            declarations = 'DECLARE $user_id AS Uint64;'
+            parameters_types = {
+                '$user_id': ydb.PrimitiveType.Uint64
+            }
+            assignments = [f'{self.usage_column} = COALESCE({self.usage_column}, 0) + 1']
+
+            if set_meetings_ts:
+                declarations += ' DECLARE $meetings_ts AS Utf8;'
+                parameters_types['$meetings_ts'] = ydb.PrimitiveType.Utf8
+
+                assignments.append(f'{self.meetings_ts_column} = CAST($meetings_ts AS Timestamp)')
+
+            elif set_meetings_ts is not None:
+                assignments.append(f'{self.meetings_ts_column} = NULL')
+
+            queries[set_meetings_ts] = ydb.DataQuery(
+                f"""
+                    {declarations}
+
+                    UPDATE {self.users_table}
+                    SET {', '.join(assignments)}
+                    WHERE {self.user_id_column} = $user_id
+                """,
+                parameters_types
+            )
+
+        return queries
+
+
+    def create_meetings_profile_query(self) -> ydb.DataQuery:
+        """
+        Build query for the first profile after after_ts or the last one
+        before before_ts or overall, so there is only one query.
+        Only the profile fields are extracted from the persistence data
+        """
+
+        profile_columns = ', '.join(
+            f'JSON_VALUE(user_data, "$.user_data.{key}") AS {key}'
+            for key in self.meetings_profile_keys
+        )
+
+        return ydb.DataQuery(
+            f"""
+                DECLARE $after_ts AS Optional<Utf8>;
+                DECLARE $before_ts AS Optional<Utf8>;
+
+                SELECT
+                num_users,
+                {profile_columns}
+                FROM (
+                    SELECT
+                    COUNT(*) AS num_users,
+                    IF(
+                        $after_ts IS NOT NULL,
+                        MIN_BY({self.data_column}, {self.meetings_ts_column}),
+                        MAX_BY({self.data_column}, {self.meetings_ts_column})
+                    ) AS user_data
+                    FROM {self.users_table} VIEW {self.meetings_index}
+                    WHERE {self.meetings_ts_column} IS NOT NULL
+                    AND ($after_ts IS NULL OR {self.meetings_ts_column} > CAST($after_ts AS Timestamp))
+                    AND ($before_ts IS NULL OR {self.meetings_ts_column} < CAST($before_ts AS Timestamp))
+                )
+            """,
+            {
+                '$after_ts': ydb.OptionalType(ydb.PrimitiveType.Utf8),
+                '$before_ts': ydb.OptionalType(ydb.PrimitiveType.Utf8)
+            }
+        )
+
+
+    def create_like_meetings_query(self) -> ydb.DataQuery:
+        """
+        Build query for getting number of likes and limited number of them
+        for the user with the specified timestamp
+        """
+
+        return ydb.DataQuery(
+            f"""
+                DECLARE $like_to_ts AS Utf8;
+                DECLARE $limit AS Uint64;
+
+                $likes = (
+                    SELECT {self.likes_link_column}
+                    FROM {self.likes_table}
+                    WHERE {self.likes_to_column} = CAST($like_to_ts AS Timestamp)
+                );
+
+                SELECT COUNT(*) AS num_likes
+                FROM $likes;
+
+                SELECT {self.likes_link_column}
+                FROM $likes
+                LIMIT $limit;
+            """,
+            {
+                '$like_to_ts': ydb.PrimitiveType.Utf8,
+                '$limit': ydb.PrimitiveType.Uint64
+            }
+        )
+
+
+    def create_timetable_query(self) -> ydb.DataQuery:
+        """
+        Build query for getting events within corresponding timestamps
+        """
+
+        return ydb.DataQuery(
+            f"""
+                DECLARE $from_ts AS Utf8;
+                DECLARE $to_ts AS Utf8;
+
+                SELECT {self.start_column}, {self.end_column}, {self.camp_column},
+                       {self.description_column}, {self.link_column}, row_num,
+                       link_null, duration
+                FROM (
+                    SELECT {self.timetable_table}.*,
+                    ({self.link_column} IS NULL) AS link_null,
+                    {self.end_column} - {self.start_column} AS duration,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY {self.camp_column}
+                        ORDER BY {self.start_column}
+                    ) AS row_num
+                    FROM {self.timetable_table}
+                    WHERE (
+                        MAX_OF(
+                            CAST($from_ts AS Timestamp),
+                            {self.start_column}
+                        ) < MIN_OF(
+                            CAST($to_ts AS Timestamp),
+                            {self.end_column}
+                        )
+                    )
+                )
+                WHERE row_num <= 2
+                ORDER BY link_null DESC,
+                         {self.camp_column},
+                         duration,
+                         {self.start_column}
+            """,
+            {
+                '$from_ts': ydb.PrimitiveType.Utf8,
+                '$to_ts': ydb.PrimitiveType.Utf8
+            }
+        )
 
 
     def create_driver(self) -> ydb.Driver:
@@ -62,13 +418,19 @@ class YDBClient:
         return driver
     
     
-    def create_pool(self):
+    def create_pool(
+        self,
+        driver
+        ) -> ydb.SessionPool:
         """
         Create the session pool instance to manage YDB sessions
         """
 
-        return ydb.SessionPool(self.driver)
-    
+        return ydb.SessionPool(
+            driver=driver,
+            size=self.pool_size
+        )
+
 
     def execute_query(
         self,
@@ -79,28 +441,49 @@ class YDBClient:
         Create a transaction to YDB and execute custom query with retry
         """
 
-        def execute(session, query, parameters):
-            """
-            Execute query using session from pool checkout
-            """
+        # Skip formatting query and parameters if debug logs are disabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Executing query %s with parameters %r', query, parameters)
 
-            # Use prepared queries for safe passing user values to the query
-            if parameters is not None:
-                query = session.prepare(query)
-
-            return session.transaction().execute(
-                query=query,
-                parameters=parameters,
-                commit_tx=True
-            )
-        
         return self.pool.retry_operation_sync(
-            callee=execute,
+            callee=execute_in_session,
+            retry_settings=self.retry_settings,
             query=query,
             parameters=parameters
         )
 
 
+    def fetch_scalar(
+        self,
+        query,
+        parameters,
+        column
+        ):
+        """
+        Execute query and return the column of its first row or None if there are no rows
+        """
+
+        rows = self.execute_query(
+            query=query,
+            parameters=parameters
+        )[0].rows
+
+        return rows[0][column] if rows else None
+
+
+    def submit(
+        self,
+        method,
+        **kwargs
+        ) -> Future:
+        """
+        Run the client method in a background thread and return its future,
+        so independent queries could overlap their round-trips
+        """
+
+        return self.executor.submit(method, **kwargs)
+
+
     def upsert_new_user(
         self,
         update
@@ -110,35 +493,19 @@ class YDBClient:
         Don't set usage column to zero since the user may be there already
         """
 
-        columns_string = f'{self.user_id_column}, {self.first_name_column}'
-        values_string = '$user_id, $first_name'
-        declarations = 'DECLARE $user_id AS Uint64; DECLARE $first_name AS Utf8;'
         parameters = {
             '$user_id': update.effective_user.id,
             '$first_name': update.effective_user.first_name
         }
 
-        # Choose correct columns since last name and username are optional
+        # Choose correct query since last name and username are optional
         if update.effective_user.last_name is not None:
-            columns_string += f', {self.last_name_column}'
-            values_string += ', $last_name'
-            declarations += ' DECLARE $last_name AS Utf8;'
             parameters['$last_name'] = update.effective_user.last_name
         
         if update.effective_user.username is not None:
-            columns_string += f', {self.username_column}'
-            values_string += ', $username'
-            declarations += ' DECLARE $username AS Utf8;'
             parameters['$username'] = update.effective_user.username
 
-        query = f"""
-            {declarations}
-
-            UPSERT INTO {self.users_table}
-            ({columns_string})
-            VALUES
-            ({values_string})
-        """
+        query = self.upsert_user_queries[('$last_name' in parameters, '$username' in parameters)]
 
         self.execute_query(
             query=query,
@@ -146,75 +513,34 @@ class YDBClient:
         )
 
 
-    def update_usage(
-        self,
-        user_id
-        ):
-        """
-        Increment user's bot usage data
-        """
-
-        declarations = 'DECLARE $user_id AS Uint64;'
-
-        query = f"""
-            {declarations}
-            
-            UPDATE {self.users_table}
-            SET {self.usage_column} = COALESCE({self.usage_column}, 0) + 1
-            WHERE {self.user_id_column} = $user_id
-        """
-
-        parameters={
-            '$user_id': user_id
-        }
-
-        self.execute_query(
-            query=query,
-            parameters=parameters
-        )
-        
-
-    def update_user_meetings(
+    def update_user_state(
         self,
         user_id,
-        meetings_ts
+        meetings_ts=None
         ):
         """
-        Set or remove meetings timestamp for the specified user
+        Increment user's bot usage data and set or remove meetings timestamp
+        for the specified user within one query.
+        Meetings timestamp is kept as is if None, removed if False and set otherwise
         """
 
-        declarations = 'DECLARE $user_id AS Uint64;'
+        set_meetings_ts = None if meetings_ts is None else bool(meetings_ts)
+
+        query = self.update_user_state_queries[set_meetings_ts]
 
         parameters = {
             '$user_id': user_id
         }
 
-        # Set meetings timestamp if present
-        if meetings_ts:
-            declarations += ' DECLARE $meetings_ts AS Utf8;'
-
-            value = 'CAST($meetings_ts AS Timestamp)'
-
+        if set_meetings_ts:
             parameters['$meetings_ts'] = meetings_ts
-        
-        # Remove it otherwise
-        else:
-            value = 'NULL'
-
-        query = f"""
-            {declarations}
-            
-            UPDATE {self.users_table}
-            SET {self.meetings_ts_column} = {value}
-            WHERE {self.user_id_column} = $user_id
-        """
 
         self.execute_query(
             query=query,
             parameters=parameters
         )
-    
-    
+
+
     def get_meetings_profile(
         self,
         after_ts,
@@ -224,70 +550,28 @@ class YDBClient:
         Return first user profile in meetings after or before specified timestamp
         """
 
-        if (after_ts is None) and (before_ts is None):
-            parameters = None
-
-            query = f"""
-               SELECT
-               COUNT(*) AS num_users,
-               MAX_BY({self.data_column}, {self.meetings_ts_column}) AS user_data
-               FROM {self.users_table} VIEW {self.meetings_index}
-               WHERE {self.meetings_ts_column} IS NOT NULL
-            """
-        
-        elif (after_ts is not None) and (before_ts is None):
-            declarations = 'DECLARE $after_ts AS Utf8;'
-
-            parameters={
-                '$after_ts': after_ts
-            }
-
-            query = f"""
-               {declarations}
-            
-               SELECT
-               COUNT(*) AS num_users,
-               MIN_BY({self.data_column}, {self.meetings_ts_column}) AS user_data
-               FROM {self.users_table} VIEW {self.meetings_index}
-               WHERE {self.meetings_ts_column} > CAST($after_ts AS Timestamp)
-            """
-        
-        elif (after_ts is None) and (before_ts is not None):
-            declarations = 'DECLARE $before_ts AS Utf8;'
-
-            parameters={
-                '$before_ts': before_ts
-            }
-
-            query = f"""
-               {declarations}
-               
-               SELECT
-               COUNT(*) AS num_users,
-               MAX_BY({self.data_column}, {self.meetings_ts_column}) AS user_data
-               FROM {self.users_table} VIEW {self.meetings_index}
-               WHERE {self.meetings_ts_column} < CAST($before_ts AS Timestamp)
-            """
-        
-        else:
+        if (after_ts is not None) and (before_ts is not None):
             raise ValueError('after_ts and before_ts could not be not None at the same time')
+
+        parameters = {
+            '$after_ts': after_ts,
+            '$before_ts': before_ts
+        }
         
         result_sets = self.execute_query(
-            query=query,
+            query=self.meetings_profile_query,
             parameters=parameters
         )
 
-        result_set = result_sets[0]
+        row = result_sets[0].rows[0]
 
-        num_users = getattr(result_set.rows[0], 'num_users')
-        user_data = getattr(result_set.rows[0], 'user_data')
+        num_users = row['num_users']
 
-        if user_data is None:
+        if num_users == 0:
             return num_users, {}
         
         else:
-            # self.data_column is either None or a valid JSON
-            return num_users, json.loads(user_data).get('user_data')
+            return num_users, {key: row[key] for key in self.meetings_profile_keys}
         
 
     def upsert_like_meetings(
@@ -300,71 +584,51 @@ class YDBClient:
         Add row to the database with likes data, if it's not here yet
         """
 
-        declarations = """
-            DECLARE $like_from_ts AS Utf8;
-            DECLARE $like_to_ts AS Utf8;
-            DECLARE $like_from_link AS Utf8;
-        """
-
-        query = f"""
-            {declarations}
-
-            UPSERT INTO {self.likes_table}
-            ({self.likes_from_column}, {self.likes_to_column}, {self.likes_link_column})
-            VALUES
-            (CAST($like_from_ts AS Timestamp), CAST($like_to_ts AS Timestamp), $like_from_link)
-        """
-
-        parameters = {
-            '$like_from_ts': like_from_ts,
-            '$like_to_ts': like_to_ts,
-            '$like_from_link': like_from_link
-        }
-
-        self.execute_query(
-            query=query,
-            parameters=parameters
+        rows = [
+            {
+                self.likes_from_column: timestamp_to_microseconds(like_from_ts),
+                self.likes_to_column: timestamp_to_microseconds(like_to_ts),
+                self.likes_link_column: like_from_link
+            }
+        ]
+
+        ydb.retry_operation_sync(
+            self.driver.table_client.bulk_upsert,
+            self.retry_settings,
+            self.likes_path,
+            rows,
+            self.likes_columns
         )
-    
+
 
     def get_like_meetings(
         self,
         like_to_ts,
+        limit
         ):
         """
-        Get likes for the user with the specified timestamp
+        Get number of likes for the user with the specified timestamp
+        and no more than the limit of them
         """
 
-        declarations = 'DECLARE $like_to_ts AS Utf8;'
-
         parameters={
-            '$like_to_ts': like_to_ts
+            '$like_to_ts': like_to_ts,
+            '$limit': limit
         }
 
-        query = f"""
-            {declarations}
-        
-            SELECT {self.likes_link_column}
-            FROM {self.likes_table}
-            WHERE {self.likes_to_column} = CAST($like_to_ts AS Timestamp)
-        """
-
         result_sets = self.execute_query(
-            query=query,
+            query=self.like_meetings_query,
             parameters=parameters
         )
 
-        result_set = result_sets[0]
+        num_likes = result_sets[0].rows[0]['num_likes']
+
+        likes_link_column = self.likes_link_column
+
+        # Rows are dicts, so access columns by key instead of getattr
+        return num_likes, [row[likes_link_column] for row in result_sets[1].rows]
 
-        likes = []
-        
-        for row in result_set.rows:
-            link = getattr(row, self.likes_link_column)
 
-            likes.append(link)
-        
-        return likes
-    
     def get_timetable(
         self,
         from_ts,
@@ -374,46 +638,13 @@ class YDBClient:
         Get events within corresponding timestamps, one current and one next for each camp
         """
 
-        declarations = """
-            DECLARE $from_ts AS Utf8;
-            DECLARE $to_ts AS Utf8;
-        """
-
         parameters={
             '$from_ts': from_ts,
             '$to_ts': to_ts
         }
 
-        query = f"""
-            {declarations}
-        
-            SELECT {self.start_column}, {self.end_column}, {self.camp_column},
-                   {self.description_column}, {self.link_column}, row_num
-            FROM (
-                SELECT {self.timetable_table}.*, ROW_NUMBER() OVER (
-                    PARTITION BY {self.camp_column}
-                    ORDER BY {self.start_column}
-                ) AS row_num
-                FROM {self.timetable_table}
-                WHERE (
-                    MAX_OF(
-                        CAST($from_ts AS Timestamp),
-                        {self.start_column}
-                    ) < MIN_OF(
-                        CAST($to_ts AS Timestamp),
-                        {self.end_column}
-                    )
-                )
-            )
-            WHERE row_num <= 2
-            ORDER BY ({self.link_column} is NULL) DESC,
-                     {self.camp_column},
-                     {self.end_column} - {self.start_column},
-                     {self.start_column}
-        """
-
         result_sets = self.execute_query(
-            query=query,
+            query=self.timetable_query,
             parameters=parameters
         )
 
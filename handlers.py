@@ -1,13 +1,18 @@
 import datetime as dt
 import html
 import logging
+import orjson
 import os
 import random
+import time
 import traceback
-import ujson as json
+from cachetools import TTLCache
 from collections import namedtuple
 from database import ydb_client
+from enum import IntEnum
+from functools import lru_cache
 from helpers import (
+    DEVELOPER_ID,
     decode_entities,
     fiter_media_group,
     notify_developer,
@@ -31,6 +36,7 @@ from telegram import (
     InputMediaVideo,
     Update
 )
+from telegram.error import TelegramError
 from telegram.ext import (
     CommandHandler,
     MessageHandler,
@@ -43,29 +49,38 @@ from telegram.utils.helpers import mention_html
 from zoneinfo import ZoneInfo
 
 timezone = ZoneInfo('Europe/Moscow')
+# Moscow has no daylight saving time, so the offset is constant
+TIMEZONE_OFFSET_SECONDS = int(dt.datetime.now(tz=timezone).utcoffset().total_seconds())
 logger = logging.getLogger()
 
-# Constants for ConversationHandler states
-StatesHolder = namedtuple('StatesHolder', [
-    'POST_CHANNEL_GET_MESSAGE',
-    'POST_CHANNEL_GET_PRIVACY',
-    'POST_CHANNEL_GET_SENDING_CONFIRMATION',
-    'MEETINGS_GET_NAME',
-    'MEETINGS_GET_PHOTO',
-    'MEETINGS_GET_BIO',
-    'MEETINGS_GET_CHANGE_CONFIRMATION',
-    'MEETINGS_GET_PARTICIPATION_CONFIRMATION',
-    'MEETINGS_GET_REMOVAL_CONFIRMATION',
-    'MEETINGS_CHOOSE_ACTION',
-    'MEETINGS_CHOOSE_PERSON_ACTION',
-    'MORTUARY_CHOOSE_ACTION',
-    'PRINCIPLES_CHOOSE_ACTION',
-    'END' # Shortcut for ConversationHandler.END, should be the last one
+# Settings from the environment, read once on import
+BOARD_LINK = os.getenv('BOARD_LINK')
+BOARD_ID = os.getenv('BOARD_ID')
+MAP_DOCUMENT_ID = os.getenv('MAP_DOCUMENT_ID')
+MAP_LINK = os.getenv('MAP_LINK')
+SHUTTLE_LINK = os.getenv('SHUTTLE_LINK')
+SHELTER_LINK = os.getenv('SHELTER_LINK')
+
+# Constants for ConversationHandler states, integers are compared
+# and persisted cheaper than their names
+states = IntEnum('States', [
+    ('POST_CHANNEL_GET_MESSAGE', 0),
+    ('POST_CHANNEL_GET_PRIVACY', 1),
+    ('POST_CHANNEL_GET_SENDING_CONFIRMATION', 2),
+    ('MEETINGS_GET_NAME', 3),
+    ('MEETINGS_GET_PHOTO', 4),
+    ('MEETINGS_GET_BIO', 5),
+    ('MEETINGS_GET_CHANGE_CONFIRMATION', 6),
+    ('MEETINGS_GET_PARTICIPATION_CONFIRMATION', 7),
+    ('MEETINGS_GET_REMOVAL_CONFIRMATION', 8),
+    ('MEETINGS_CHOOSE_ACTION', 9),
+    ('MEETINGS_CHOOSE_PERSON_ACTION', 10),
+    ('MORTUARY_CHOOSE_ACTION', 11),
+    ('PRINCIPLES_CHOOSE_ACTION', 12),
+    # Shortcut for ConversationHandler.END
+    ('END', ConversationHandler.END)
 ])
 
-# Set constant values to their names, except for the last one
-states = StatesHolder(*StatesHolder._fields[:-1], ConversationHandler.END)
-
 # Constants for InlineKeyboardButton callback data
 CallbackHolder = namedtuple('CallbackHolder', [
     'POST_CHANNEL_START',
@@ -115,7 +130,8 @@ TypesHolder = namedtuple('TypesHolder', [
     'DOCUMENT',
     'PHOTO',
     'TEXT',
-    'VIDEO'
+    'VIDEO',
+    'VOICE'
 ])
 
 types = TypesHolder(*TypesHolder._fields)
@@ -124,8 +140,704 @@ types = TypesHolder(*TypesHolder._fields)
 # Missing in telegram.constants
 MAX_NAME_LENGTH = 64
 
+# Mention of the same user with the same name doesn't change,
+# so escape the name once for the next conversations of the warm instance
+cached_mention_html = lru_cache(maxsize=1024)(mention_html)
+
+# Users saved to the database by this instance within the last hour
+recent_users = TTLCache(
+    maxsize=10000,
+    ttl=3600
+)
+
+# Meetings profiles by timestamps of their neighbours, fetched by this instance within the last minute.
+# Flipping profiles back and forth doesn't query the database, while changes of others appear shortly
+meetings_profiles = TTLCache(
+    maxsize=4096,
+    ttl=60
+)
+
 # Period in the timetable, from the current timestamp to the next number of hours
 TIMETABLE_PERIOD_HOURS = 2
+TIMETABLE_PERIOD_SECONDS = TIMETABLE_PERIOD_HOURS * 3600
+
+# Timetable messages built by this instance within the last half a minute
+TIMETABLE_CACHE_KEY = 'timetable'
+
+timetable_messages = TTLCache(
+    maxsize=1,
+    ttl=30
+)
+
+HELP_TEXT = (
+    'Давай расскажу, что я умею!\n\n'
+    f'Во-первых, через меня ты можешь написать в <a href="{BOARD_LINK}">общий канал</a> Холодка. '
+    'В нем можно найти актуальную геопозицию шаттла между «Дружбой» и «Зеленым городком», разные объявления, '
+    'а также привязанную к нему группу для комментирования постов в канале.\n\n'
+    'Во-вторых, здесь можно познакомиться с другими участниками Холодка! Для этого необходимо '
+    'заполнить немного информации о себе и затем договориться о встрече. А еще там можно ставить и получать лайки :)\n\n'
+    'В-третьих, у нас собрана информация о всех лагерях Холодка и даже расписание их событий, которое мы показываем '
+    'на ближайшие два часа. Теперь можно легко понять, пора идти завтракать или уже обедать.\n\n'
+    'Также здесь можно найти карту Холодка в двух вариантах, ссылку на радио ШалашFM, мемы на тему смерти от лагеря '
+    '«ПогребальНЯ и Душный бар», 10 принципов Burning Man, по которым живет наше сообщество, и телефон для экстренной связи со штабом'
+)
+
+POST_CHANNEL_START_TEXT = (
+    f'Напиши мне сообщение, которое нужно отправить в общий <a href="{BOARD_LINK}">канал</a>.\n\n'
+    'Например, объявление о том, что у вас сейчас начинается классная активность, '
+    'просьбу помочь что-то найти, или даже признание в любви! Мемы тоже годятся :)\n\n'
+    'Отправить сообщение можно от своего имени или анонимно. '
+    'Это может быть текстовое сообщение или медиа с подписью или без (например, фото или видео), но не альбом из них.'
+)
+
+POST_CHANNEL_DONE_TEXT = (
+    f'<a href="{BOARD_LINK}">Готово!</a>\n\n'
+    'Что хочешь сделать теперь?'
+)
+
+MEETINGS_REGISTRATION_TEXT = (
+    'Чтобы найти новые знакомства на Холодке, сначала необходимо зарегистрироваться — '
+    'написать свое имя и пару слов о себе, а также приложить свое фото или видео, чтобы остальные '
+    'участники могли тебя узнать. После этого можно будет посмотреть на всех остальных и даже поставить '
+    'кому-нибудь лайк!\n\n'
+    'Для начала напиши, как тебя зовут?'
+)
+
+LIKES_TEXT = 'Вот кто уже успел поставить тебе лайк:\n\n'
+
+LIKES_OVERFLOW_TEXT = (
+    'Тебе поставили уже столько лайков, что они не умещаются в одно сообщение! 😱\n\n'
+    'Поэтому покажу только тех, кто в него уместился:\n\n'
+)
+
+LIKES_SEPARATOR = '\n\n'
+
+LIKES_MENU_TEXT = '\n\nЧто хочешь сделать теперь?'
+
+# Each like is a mention of at least about 32 characters with the separator,
+# so no more than this number of likes fits into one message
+LIKES_LIMIT = constants.MAX_MESSAGE_LENGTH // 32
+
+MAP_CAPTION = (
+    'Карту Холодка можно посмотреть сразу в двух вариантах: '
+    f'интерактивную на <a href="{MAP_LINK}">Google Maps</a> или '
+    'статичную, но очень красивую в виде вот такого изображения ↑\n\n'
+    'Чтобы построить маршрут на карте, откройте ссылку на Google Maps, '
+    'затем нажмите слева вверху символ меню, выберете в списке нужный вам кэмп '
+    'и наконец вверху страницы справа от названия кэмпа нажмите на стрелку вправо, '
+    'тогда Google построит маршрут от вашего местоположения до этого места'
+)
+
+SHUTTLE_TEXT = (
+    'Текущую геолокацию шаттла между «Дружбой» и «Зеленым городком» можно найти в '
+    f'<a href="{SHUTTLE_LINK}">данном сообщении</a> канала «Холодок: Объявления»'
+)
+
+SHELTER_TEXT = (
+    f'Послушать радио <a href="https://telegra.ph/Piratskoe-radio-SHalashFM-02-19">'
+    f'лагеря ШалашFM</a> можно на волне 93.0 FM или по следующей ссылке: {SHELTER_LINK}'
+)
+
+TIMETABLE_TEXT = (
+    'По расписанию на Холодке работает только столовая, но примерно в '
+    f'ближайшие {TIMETABLE_PERIOD_HOURS} часа можно ожидать следующего (полное расписание '
+    'лагерей по ссылкам):'
+)
+
+TIMETABLE_EMPTY_TEXT = 'В расписании в ближайшее время ничего нет, но в реальности наверняка что-то происходит!'
+
+# Camps list doesn't fit into one message, so it's split in halves
+CAMPS_TEXT_1 = (
+    'Список всех лагерей на Холодке вместе с их описаниями:\n\n•' + \
+    '\n•'.join(f'<a href="{camp[1]}">{camp[0]}</a>' for camp in camps_data[:len(camps_data) // 2])
+)
+
+CAMPS_TEXT_2 = (
+    '•' + \
+    '\n•'.join(f'<a href="{camp[1]}">{camp[0]}</a>' for camp in camps_data[len(camps_data) // 2:])
+)
+
+# Conversation data keys to remove from user data when conversation ends
+POST_CHANNEL_MESSAGE_KEYS = (
+    'post_channel_message',
+    'post_channel_message_type',
+    'post_channel_message_id',
+    'post_channel_full_message'
+)
+
+POST_CHANNEL_KEYS = POST_CHANNEL_MESSAGE_KEYS + (
+    'post_channel_public_footer',
+    'post_channel_private_footer',
+    'post_channel_footer_max_length'
+)
+
+MEETINGS_KEYS = (
+    'meetings_name',
+    'meetings_link',
+    'meetings_file_type',
+    'meetings_file_id',
+    'meetings_bio',
+    'meetings_caption',
+    'meetings_ts'
+)
+
+# Media classes to show a message of the corresponding type
+INPUT_MEDIA = {
+    types.ANIMATION: InputMediaAnimation,
+    types.AUDIO: InputMediaAudio,
+    types.DOCUMENT: InputMediaDocument,
+    types.PHOTO: InputMediaPhoto,
+    types.VIDEO: InputMediaVideo
+}
+
+# Media types published by copying the user's message with a new caption
+COPY_TYPES = frozenset((
+    types.ANIMATION,
+    types.AUDIO,
+    types.DOCUMENT,
+    types.PHOTO,
+    types.VIDEO,
+    types.VOICE
+))
+
+# Message attributes with media by their types in order of checking
+MEDIA_ATTRIBUTES = (
+    # Animation should be checked before document
+    ('animation', types.ANIMATION),
+    ('audio', types.AUDIO),
+    ('document', types.DOCUMENT),
+    # Photo attribute is a possibly empty list
+    ('photo', types.PHOTO),
+    ('video', types.VIDEO),
+    ('voice', types.VOICE)
+)
+
+# Commands handled outside of conversations without user data,
+# so there is no need to load and save it for them
+STATELESS_COMMANDS = frozenset((
+    'start',
+    'help',
+    'camps',
+    'timetable',
+    'map',
+    'shuttle',
+    'shalashfm',
+    'sos'
+))
+
+# Message filters shared between handlers
+TEXT_FILTER = Filters.text & (~Filters.command)
+NOT_MEDIA_GROUP_FILTER = ~fiter_media_group
+MEDIA_FILTER = (
+    Filters.animation |
+    Filters.audio |
+    Filters.document |
+    Filters.photo |
+    Filters.video
+)
+
+# Text or media with captions without groups
+POST_CHANNEL_MESSAGE_FILTER = (TEXT_FILTER | MEDIA_FILTER | Filters.voice) & NOT_MEDIA_GROUP_FILTER
+MEETINGS_MEDIA_FILTER = (Filters.photo | Filters.video) & NOT_MEDIA_GROUP_FILTER
+MAGIC_MEDIA_FILTER = Filters.caption(['симсалабим']) & MEDIA_FILTER & NOT_MEDIA_GROUP_FILTER
+
+# Static keyboards are built once and shared between updates
+TOP_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Написать в канал',
+                callback_data=callbacks.POST_CHANNEL_START
+            ),
+            InlineKeyboardButton(
+                text='Познакомиться',
+                callback_data=callbacks.MEETINGS_START
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                text='Почитать о кэмпах',
+                callback_data=callbacks.CAMPS_START
+            ),
+            InlineKeyboardButton(
+                text='Узнать расписание',
+                callback_data=callbacks.TIMETABLE_START
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                text='Посмотреть на карту',
+                callback_data=callbacks.MAP_START
+            ),
+            InlineKeyboardButton(
+                text='Найти шаттл',
+                callback_data=callbacks.SHUTTLE_START
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                text='Послушать ШалашFM',
+                callback_data=callbacks.SHELTER_START
+            ),
+            InlineKeyboardButton(
+                text='Умереть от смеха',
+                callback_data=callbacks.MORTUARY_START
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                text='Вспомнить принципы',
+                callback_data=callbacks.PRINCIPLES_START
+            ),
+            InlineKeyboardButton(
+                text='Позвать на помощь',
+                callback_data=callbacks.SOS_START
+            ),
+        ]
+    ],
+    resize_keyboard=True
+)
+
+POST_CHANNEL_BACK_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.POST_CHANNEL_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+POST_CHANNEL_CANCEL_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Отмена',
+                callback_data=callbacks.POST_CHANNEL_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MEETINGS_BACK_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.MEETINGS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MEETINGS_CANCEL_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Отмена',
+                callback_data=callbacks.MEETINGS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+POST_CHANNEL_PRIVACY_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='От меня',
+                callback_data=callbacks.POST_CHANNEL_PUBLIC
+            ),
+            InlineKeyboardButton(
+                text='Анонимно',
+                callback_data=callbacks.POST_CHANNEL_PRIVATE
+            ),
+            InlineKeyboardButton(
+                text='Отмена',
+                callback_data=callbacks.POST_CHANNEL_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+POST_CHANNEL_CONFIRM_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Да!',
+                callback_data=callbacks.POST_CHANNEL_CONFIRM_SENDING
+            ),
+            InlineKeyboardButton(
+                text='Нет 💁‍♂️',
+                callback_data=callbacks.POST_CHANNEL_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MEETINGS_MENU_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Посмотреть на всех',
+                callback_data=callbacks.MEETINGS_SHOW_PEOPLE
+            ),
+            InlineKeyboardButton(
+                text='Посмотреть на лайки',
+                callback_data=callbacks.MEETINGS_SHOW_LIKES
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text='Изменить информацию',
+                callback_data=callbacks.MEETINGS_CHANGE
+            ),
+            InlineKeyboardButton(
+                text='Прекратить участие',
+                callback_data=callbacks.MEETINGS_REMOVE
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.MEETINGS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MEETINGS_CONFIRM_PARTICIPATION_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Да!',
+                callback_data=callbacks.MEETINGS_CONFIRM_PARTICIPATION
+            ),
+            InlineKeyboardButton(
+                text='Нет 💁‍♂️',
+                callback_data=callbacks.MEETINGS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MEETINGS_CONFIRM_CHANGE_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Да!',
+                callback_data=callbacks.MEETINGS_CONFIRM_CHANGE
+            ),
+            InlineKeyboardButton(
+                text='Нет 💁‍♂️',
+                callback_data=callbacks.MEETINGS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MEETINGS_CONFIRM_REMOVAL_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Да!',
+                callback_data=callbacks.MEETINGS_CONFIRM_REMOVAL
+            ),
+            InlineKeyboardButton(
+                text='Нет 💁‍♂️',
+                callback_data=callbacks.MEETINGS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MEETINGS_PEOPLE_BOTH_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='‹',
+                callback_data=callbacks.MEETINGS_SHOW_PEOPLE_LEFT
+            ),
+            InlineKeyboardButton(
+                text='·💜·',
+                callback_data=callbacks.MEETINGS_LIKE
+            ),
+            InlineKeyboardButton(
+                text='›',
+                callback_data=callbacks.MEETINGS_SHOW_PEOPLE_RIGHT
+            ),
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.MEETINGS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MEETINGS_PEOPLE_LEFT_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='‹',
+                callback_data=callbacks.MEETINGS_SHOW_PEOPLE_LEFT
+            ),
+            InlineKeyboardButton(
+                text='·💜·',
+                callback_data=callbacks.MEETINGS_LIKE
+            ),
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.MEETINGS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MEETINGS_PEOPLE_RIGHT_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='·💜·',
+                callback_data=callbacks.MEETINGS_LIKE
+            ),
+            InlineKeyboardButton(
+                text='›',
+                callback_data=callbacks.MEETINGS_SHOW_PEOPLE_RIGHT
+            ),
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.MEETINGS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+CAMPS_BACK_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.CAMPS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+TIMETABLE_BACK_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.TIMETABLE_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MAP_BACK_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.MAP_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+SHUTTLE_BACK_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.SHUTTLE_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+SHELTER_BACK_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.SHELTER_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MORTUARY_MENU_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Показать мем',
+                callback_data=callbacks.MORTUARY_SHOW_MEME
+            ),
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.MORTUARY_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+MORTUARY_START_OVER_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Начать заново',
+                callback_data=callbacks.MORTUARY_START_OVER
+            ),
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.MORTUARY_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+SOS_BACK_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text='Назад',
+                callback_data=callbacks.SOS_STOP
+            )
+        ]
+    ],
+    resize_keyboard=True
+)
+
+# Whether there are left and right buttons in meetings profiles menu by whether
+# the profile is shown after or before another one and there are more profiles in that direction
+MEETINGS_PEOPLE_BUTTONS = {
+    (False, False, False): (False, False),
+    (False, False, True): (False, True),
+    (True, False, False): (False, True),
+    (True, False, True): (True, True),
+    (False, True, False): (True, False),
+    (False, True, True): (True, True)
+}
+
+# Menu of meetings profiles by whether there are left and right buttons
+MEETINGS_PEOPLE_MARKUPS = {
+    (True, True): MEETINGS_PEOPLE_BOTH_MARKUP,
+    (True, False): MEETINGS_PEOPLE_LEFT_MARKUP,
+    (False, True): MEETINGS_PEOPLE_RIGHT_MARKUP,
+    (False, False): MEETINGS_BACK_MARKUP
+}
+
+
+def create_principles_markup(
+    current_page,
+    current_page_format=True
+    ) -> str:
+    """
+    Build menu with paginated list of all principles and back button
+    """
+
+    paginator = InlineKeyboardPaginator(
+        page_count=len(principles_data),
+        current_page=current_page,
+        current_page_format=current_page_format,
+        data_pattern=callbacks.PRINCIPLES_PAGE + '#{page}'
+    )
+
+    paginator.add_after(
+        InlineKeyboardButton(
+            text='Назад',
+            callback_data=callbacks.PRINCIPLES_STOP
+        )
+    )
+
+    return paginator.markup
+
+
+# Principles are static, so build the menu for each page once
+PRINCIPLES_START_MARKUP = create_principles_markup(
+    current_page=None,
+    current_page_format=False
+)
+
+PRINCIPLES_PAGE_MARKUPS = {
+    page: create_principles_markup(current_page=page)
+    for page in range(1, len(principles_data) + 1)
+}
+
+
+def get_timestamp(
+    delta_seconds=0,
+    now_ns=None
+    ) -> str:
+    """
+    Get current or specified time with actual timezone shifted by delta as a string
+    with format required by YDB, without creating datetime objects
+    """
+
+    if now_ns is None:
+        now_ns = time.time_ns()
+
+    seconds, nanoseconds = divmod(now_ns, 10**9)
+
+    t = time.gmtime(seconds + TIMEZONE_OFFSET_SECONDS + delta_seconds)
+
+    return (
+        f'{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}'
+        f'T{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}.{nanoseconds // 1000:06d}Z'
+    )
+
+
+def get_message_media(message) -> tuple:
+    """
+    Get the type of media attached to the message and the media itself,
+    or None for both if there is no media
+    """
+
+    for attribute, media_type in MEDIA_ATTRIBUTES:
+        media = getattr(message, attribute)
+
+        if media:
+            return media_type, media
+
+    return None, None
+
+
+def is_stateless_update(update) -> bool:
+    """
+    Check whether the update is a command which doesn't use user data and conversations
+    """
+
+    message = update.message
+
+    if (message is None) or (message.text is None) or (not message.text.startswith('/')):
+        return False
+
+    # Command may be followed by arguments and addressed to the bot by its username
+    command = message.text.split(maxsplit=1)[0][1:].partition('@')[0]
+
+    return command in STATELESS_COMMANDS
 
 
 def on_start(update, context):
@@ -133,11 +845,26 @@ def on_start(update, context):
     Send a message when the command /start is issued
     """
 
+    # Skip the database if the user has already been saved by this instance recently,
+    # otherwise save them in the background while replying
+    if update.effective_user.id not in recent_users:
+        upsert_future = ydb_client.submit(
+            ydb_client.upsert_new_user,
+            update=update
+        )
+    
+    else:
+        upsert_future = None
+
     on_help(update, context)
 
     on_top(update, context)
-    
-    ydb_client.upsert_new_user(update=update)
+
+    # Wait for the query anyway, since the function instance could be frozen after returning
+    if upsert_future is not None:
+        upsert_future.result()
+
+        recent_users[update.effective_user.id] = True
 
 
 def on_help(update, context):
@@ -148,18 +875,7 @@ def on_help(update, context):
     reply_or_edit_message(
         update=update,
         context=context,
-        text=(
-            'Давай расскажу, что я умею!\n\n'
-            f'Во-первых, через меня ты можешь написать в <a href="{os.getenv("BOARD_LINK")}">общий канал</a> Холодка. '
-            'В нем можно найти актуальную геопозицию шаттла между «Дружбой» и «Зеленым городком», разные объявления, '
-            'а также привязанную к нему группу для комментирования постов в канале.\n\n'
-            'Во-вторых, здесь можно познакомиться с другими участниками Холодка! Для этого необходимо '
-            'заполнить немного информации о себе и затем договориться о встрече. А еще там можно ставить и получать лайки :)\n\n'
-            'В-третьих, у нас собрана информация о всех лагерях Холодка и даже расписание их событий, которое мы показываем '
-            'на ближайшие два часа. Теперь можно легко понять, пора идти завтракать или уже обедать.\n\n'
-            'Также здесь можно найти карту Холодка в двух вариантах, ссылку на радио ШалашFM, мемы на тему смерти от лагеря '
-            '«ПогребальНЯ и Душный бар», 10 принципов Burning Man, по которым живет наше сообщество, и телефон для экстренной связи со штабом'
-        ),
+        text=HELP_TEXT,
         parse_mode='HTML'
     )
 
@@ -184,61 +900,7 @@ def on_top(
         context=context,
         text=text,
         media=media,
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Написать в канал',
-                        callback_data=callbacks.POST_CHANNEL_START
-                    ),
-                    InlineKeyboardButton(
-                        text='Познакомиться',
-                        callback_data=callbacks.MEETINGS_START
-                    ),
-                ],
-                [
-                    InlineKeyboardButton(
-                        text='Почитать о кэмпах',
-                        callback_data=callbacks.CAMPS_START
-                    ),
-                    InlineKeyboardButton(
-                        text='Узнать расписание',
-                        callback_data=callbacks.TIMETABLE_START
-                    ),
-                ],
-                [
-                    InlineKeyboardButton(
-                        text='Посмотреть на карту',
-                        callback_data=callbacks.MAP_START
-                    ),
-                    InlineKeyboardButton(
-                        text='Найти шаттл',
-                        callback_data=callbacks.SHUTTLE_START
-                    ),
-                ],
-                [
-                    InlineKeyboardButton(
-                        text='Послушать ШалашFM',
-                        callback_data=callbacks.SHELTER_START
-                    ),
-                    InlineKeyboardButton(
-                        text='Умереть от смеха',
-                        callback_data=callbacks.MORTUARY_START
-                    ),
-                ],
-                [
-                    InlineKeyboardButton(
-                        text='Вспомнить принципы',
-                        callback_data=callbacks.PRINCIPLES_START
-                    ),
-                    InlineKeyboardButton(
-                        text='Позвать на помощь',
-                        callback_data=callbacks.SOS_START
-                    ),
-                ]
-            ],
-            resize_keyboard=True
-        ),
+        reply_markup=reply_markup or TOP_MARKUP,
         parse_mode=parse_mode,
         disable_web_page_preview=disable_web_page_preview,
         force_new_message=force_new_message
@@ -256,7 +918,7 @@ def post_channel_start(update, context):
     if update.effective_user.last_name is not None:
         full_name += f' {update.effective_user.last_name}'
     
-    context.user_data['post_channel_public_footer'] = f'\n\n — {mention_html(update.effective_user.id, full_name)}'
+    context.user_data['post_channel_public_footer'] = f'\n\n — {cached_mention_html(update.effective_user.id, full_name)}'
 
     context.user_data['post_channel_private_footer'] = f'\n\n — Аноним'
 
@@ -268,24 +930,8 @@ def post_channel_start(update, context):
     reply_or_edit_message(
         update=update,
         context=context,
-        text=(
-            f'Напиши мне сообщение, которое нужно отправить в общий <a href="{os.getenv("BOARD_LINK")}">канал</a>.\n\n'
-            'Например, объявление о том, что у вас сейчас начинается классная активность, '
-            'просьбу помочь что-то найти, или даже признание в любви! Мемы тоже годятся :)\n\n'
-            'Отправить сообщение можно от своего имени или анонимно. '
-            'Это может быть текстовое сообщение или медиа с подписью или без (например, фото или видео), но не альбом из них.'
-        ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.POST_CHANNEL_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        ),
+        text=POST_CHANNEL_START_TEXT,
+        reply_markup=POST_CHANNEL_BACK_MARKUP,
         parse_mode='HTML'
     )
 
@@ -297,75 +943,44 @@ def post_channel_message(update, context):
     Check a message length from the user to post it in the board channel
     """
 
-    user_length = 0
-    max_length = constants.MAX_CAPTION_LENGTH
+    message = update.message
 
-    if update.message.text is not None:
-        user_length = len(update.message.text)
+    # Classify the message in one pass, media is copied later by the message id
+    if message.text is not None:
+        message_type = types.TEXT
+        message_text = message.text
         max_length = constants.MAX_MESSAGE_LENGTH
-    
-    elif update.message.caption is not None:
-        user_length = len(update.message.caption)
+        parse_entities = message.parse_entities
+
+    else:
+        message_text = message.caption
         max_length = constants.MAX_CAPTION_LENGTH
+        parse_entities = message.parse_caption_entities
+
+        message_type, _ = get_message_media(message)
+
+        if message_type is None:
+            return on_unknown(update, context)
 
     # In fact max length depends on formatting, but let's simplify it here
-    if user_length + context.user_data['post_channel_footer_max_length'] > max_length:
+    max_length -= context.user_data['post_channel_footer_max_length']
+
+    if (message_text is not None) and (len(message_text) > max_length):
         # Ask for another message
         return post_channeltoo_long(update, context)
     
     # Save user message or caption with entities decoded to HTML if present
-    if update.message.text is not None:
-        entities = update.message.parse_entities()
-
+    if message_text is not None:
         context.user_data['post_channel_message'] = decode_entities(
-            message_text=update.message.text,
-            entities=entities
-        )
-    
-    elif update.message.caption is not None:
-        entities = update.message.parse_caption_entities()
-
-        context.user_data['post_channel_message'] = decode_entities(
-            message_text=update.message.caption,
-            entities=entities
+            message_text=message_text,
+            entities=parse_entities()
         )
     
     else:
         context.user_data['post_channel_message'] = ''
 
-    # Save user message type and file if present
-    if update.message.text is not None:
-        context.user_data['post_channel_message_type'] = types.TEXT
-    
-    # Animation should be checked before document
-    elif update.message.animation is not None:
-        context.user_data['post_channel_message_type'] = types.ANIMATION
-        context.user_data['post_channel_file_id'] = update.message.animation.file_id
-
-    elif update.message.audio is not None:
-        context.user_data['post_channel_message_type'] = types.AUDIO
-        context.user_data['post_channel_file_id'] = update.message.audio.file_id
-
-    elif update.message.document is not None:
-        context.user_data['post_channel_message_type'] = types.DOCUMENT
-        context.user_data['post_channel_file_id'] = update.message.document.file_id
-
-    # Photo attribute is a possibly empty list
-    elif update.message.photo:
-        context.user_data['post_channel_message_type'] = types.PHOTO
-        # Photo is a list of telegram.PhotoSize with available sizes of the photo
-        context.user_data['post_channel_file_id'] = update.message.photo[0].file_id
-
-    elif update.message.video is not None:
-        context.user_data['post_channel_message_type'] = types.VIDEO
-        context.user_data['post_channel_file_id'] = update.message.video.file_id
-
-    elif update.message.voice is not None:
-        context.user_data['post_channel_message_type'] = types.VOICE
-        context.user_data['post_channel_file_id'] = update.message.voice.file_id
-    
-    else:
-        return on_unknown(update, context)
+    context.user_data['post_channel_message_type'] = message_type
+    context.user_data['post_channel_message_id'] = message.message_id
     
     # Ask for privacy settings
     reply_or_edit_message(
@@ -374,25 +989,7 @@ def post_channel_message(update, context):
         text=(
             'Отлично, будем посылать сообщение в канал от твоего имени или анонимно?'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='От меня',
-                        callback_data=callbacks.POST_CHANNEL_PUBLIC
-                    ),
-                    InlineKeyboardButton(
-                        text='Анонимно',
-                        callback_data=callbacks.POST_CHANNEL_PRIVATE
-                    ),
-                    InlineKeyboardButton(
-                        text='Отмена',
-                        callback_data=callbacks.POST_CHANNEL_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
+        reply_markup=POST_CHANNEL_PRIVACY_MARKUP
     )
     
     return states.POST_CHANNEL_GET_PRIVACY
@@ -403,15 +1000,18 @@ def post_channel_privacy(update, context):
     Show user its message and ask if they are sure to post it in the board channel
     """
 
-    full_message = context.user_data.get('post_channel_message', '')
+    user_data = context.user_data
+    privacy = update.callback_query.data
 
-    if update.callback_query.data == callbacks.POST_CHANNEL_PUBLIC:
-        full_message += context.user_data.get('post_channel_public_footer', '')
+    full_message = user_data.get('post_channel_message', '')
+
+    if privacy == callbacks.POST_CHANNEL_PUBLIC:
+        full_message += user_data.get('post_channel_public_footer', '')
     
-    elif update.callback_query.data == callbacks.POST_CHANNEL_PRIVATE:
-        full_message += context.user_data.get('post_channel_private_footer', '')
+    elif privacy == callbacks.POST_CHANNEL_PRIVATE:
+        full_message += user_data.get('post_channel_private_footer', '')
     
-    context.user_data['post_channel_full_message'] = full_message
+    user_data['post_channel_full_message'] = full_message
 
     reply_or_edit_message(
         update=update,
@@ -421,55 +1021,10 @@ def post_channel_privacy(update, context):
         )
     )
 
-    if context.user_data.get('post_channel_message_type') == types.ANIMATION:
-        reply_or_edit_message(
-            update=update,
-            context=context,
-            media=InputMediaAnimation(
-                media=context.user_data.get('post_channel_file_id'),
-                caption=full_message,
-                parse_mode='HTML'
-            ),
-            force_new_message=True
-        )
-    
-    elif context.user_data.get('post_channel_message_type') == types.AUDIO:
-        reply_or_edit_message(
-            update=update,
-            context=context,
-            media=InputMediaAudio(
-                media=context.user_data.get('post_channel_file_id'),
-                caption=full_message,
-                parse_mode='HTML'
-            ),
-            force_new_message=True
-        )
+    message_type = user_data.get('post_channel_message_type')
 
-    elif context.user_data.get('post_channel_message_type') == types.DOCUMENT:
-        reply_or_edit_message(
-            update=update,
-            context=context,
-            media=InputMediaDocument(
-                media=context.user_data.get('post_channel_file_id'),
-                caption=full_message,
-                parse_mode='HTML'
-            ),
-            force_new_message=True
-        )
-    
-    elif context.user_data.get('post_channel_message_type') == types.PHOTO:
-        reply_or_edit_message(
-            update=update,
-            context=context,
-            media=InputMediaPhoto(
-                media=context.user_data.get('post_channel_file_id'),
-                caption=full_message,
-                parse_mode='HTML'
-            ),
-            force_new_message=True
-        )
-    
-    elif context.user_data.get('post_channel_message_type') == types.TEXT:
+    # Text of the message couldn't be replaced on copying, so send it
+    if message_type == types.TEXT:
         reply_or_edit_message(
             update=update,
             context=context,
@@ -478,16 +1033,13 @@ def post_channel_privacy(update, context):
             force_new_message=True
         )
     
-    elif context.user_data.get('post_channel_message_type') == types.VIDEO:
-        reply_or_edit_message(
-            update=update,
-            context=context,
-            media=InputMediaVideo(
-                media=context.user_data.get('post_channel_file_id'),
-                caption=full_message,
-                parse_mode='HTML'
-            ),
-            force_new_message=True
+    elif message_type in COPY_TYPES:
+        context.bot.copy_message(
+            chat_id=update.effective_chat.id,
+            from_chat_id=update.effective_chat.id,
+            message_id=user_data.get('post_channel_message_id'),
+            caption=full_message,
+            parse_mode='HTML'
         )
     
     else:
@@ -499,21 +1051,7 @@ def post_channel_privacy(update, context):
         text=(
             'Отправляем?'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Да!',
-                        callback_data=callbacks.POST_CHANNEL_CONFIRM_SENDING
-                    ),
-                    InlineKeyboardButton(
-                        text='Нет 💁‍♂️',
-                        callback_data=callbacks.POST_CHANNEL_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        ),
+        reply_markup=POST_CHANNEL_CONFIRM_MARKUP,
         force_new_message=True
     )
 
@@ -525,51 +1063,26 @@ def post_channel_confirm_sending(update, context):
     Send a message to the board channel based on privacy settings
     """
     
+    user_data = context.user_data
+    message_type = user_data.get('post_channel_message_type')
+    full_message = user_data.get('post_channel_full_message')
+
     # Send message to the channel
-    if context.user_data.get('post_channel_message_type') == types.ANIMATION:
-        context.bot.send_animation(
-            chat_id=os.getenv('BOARD_ID'),
-            animation=context.user_data.get('post_channel_file_id'),
-            caption=context.user_data.get('post_channel_full_message'),
-            parse_mode='HTML'
-        )
-    
-    elif context.user_data.get('post_channel_message_type') == types.AUDIO:
-        context.bot.send_audio(
-            chat_id=os.getenv('BOARD_ID'),
-            audio=context.user_data.get('post_channel_file_id'),
-            caption=context.user_data.get('post_channel_full_message'),
-            parse_mode='HTML'
-        )
 
-    elif context.user_data.get('post_channel_message_type') == types.DOCUMENT:
-        context.bot.send_document(
-            chat_id=os.getenv('BOARD_ID'),
-            document=context.user_data.get('post_channel_file_id'),
-            caption=context.user_data.get('post_channel_full_message'),
-            parse_mode='HTML'
-        )
-    
-    elif context.user_data.get('post_channel_message_type') == types.PHOTO:
-        context.bot.send_photo(
-            chat_id=os.getenv('BOARD_ID'),
-            photo=context.user_data.get('post_channel_file_id'),
-            caption=context.user_data.get('post_channel_full_message'),
-            parse_mode='HTML'
-        )
-    
-    elif context.user_data.get('post_channel_message_type') == types.TEXT:
+    if message_type == types.TEXT:
         context.bot.send_message(
-            chat_id=os.getenv('BOARD_ID'),
-            text=context.user_data.get('post_channel_full_message'),
+            chat_id=BOARD_ID,
+            text=full_message,
             parse_mode='HTML'
         )
     
-    elif context.user_data.get('post_channel_message_type') == types.VIDEO:
-        context.bot.send_video(
-            chat_id=os.getenv('BOARD_ID'),
-            video=context.user_data.get('post_channel_file_id'),
-            caption=context.user_data.get('post_channel_full_message'),
+    # Copy media from the user's message with the new caption
+    elif message_type in COPY_TYPES:
+        context.bot.copy_message(
+            chat_id=BOARD_ID,
+            from_chat_id=update.effective_chat.id,
+            message_id=user_data.get('post_channel_message_id'),
+            caption=full_message,
             parse_mode='HTML'
         )
     
@@ -580,21 +1093,13 @@ def post_channel_confirm_sending(update, context):
     on_top(
         update=update,
         context=context,
-        text=(
-            f'<a href="{os.getenv("BOARD_LINK")}">Готово!</a>\n\n'
-            'Что хочешь сделать теперь?'
-        ),
+        text=POST_CHANNEL_DONE_TEXT,
         parse_mode='HTML'
     )
 
     # Remove post channel data if present
-    context.user_data.pop('post_channel_message', None)
-    context.user_data.pop('post_channel_message_type', None)
-    context.user_data.pop('post_channel_file_id', None)
-    context.user_data.pop('post_channel_full_message', None)
-    context.user_data.pop('post_channel_public_footer', None)
-    context.user_data.pop('post_channel_private_footer', None)
-    context.user_data.pop('post_channel_footer_max_length', None)
+    for key in POST_CHANNEL_KEYS:
+        user_data.pop(key, None)
 
     return states.END
 
@@ -607,13 +1112,10 @@ def post_channel_stop(update, context):
     on_top(update, context)
 
     # Remove post channel data if present
-    context.user_data.pop('post_channel_message', None)
-    context.user_data.pop('post_channel_message_type', None)
-    context.user_data.pop('post_channel_file_id', None)
-    context.user_data.pop('post_channel_full_message', None)
-    context.user_data.pop('post_channel_public_footer', None)
-    context.user_data.pop('post_channel_private_footer', None)
-    context.user_data.pop('post_channel_footer_max_length', None)
+    user_data_pop = context.user_data.pop
+
+    for key in POST_CHANNEL_KEYS:
+        user_data_pop(key, None)
 
     return states.END
 
@@ -629,24 +1131,14 @@ def post_channeltoo_long(update, context):
         text=(
             'Чересчур длинное у тебя сообщение получилось. Попробуй написать еще раз покороче'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Отмена',
-                        callback_data=callbacks.POST_CHANNEL_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
+        reply_markup=POST_CHANNEL_CANCEL_MARKUP
     )
 
     # Remove message data if present
-    context.user_data.pop('post_channel_message', None)
-    context.user_data.pop('post_channel_message_type', None)
-    context.user_data.pop('post_channel_file_id', None)
-    context.user_data.pop('post_channel_full_message', None)
+    user_data_pop = context.user_data.pop
+
+    for key in POST_CHANNEL_MESSAGE_KEYS:
+        user_data_pop(key, None)
 
     return states.POST_CHANNEL_GET_MESSAGE
 
@@ -665,37 +1157,7 @@ def meetings_start(update, context, text=None):
             update=update,
             context=context,
             text=text,
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text='Посмотреть на всех',
-                            callback_data=callbacks.MEETINGS_SHOW_PEOPLE
-                        ),
-                        InlineKeyboardButton(
-                            text='Посмотреть на лайки',
-                            callback_data=callbacks.MEETINGS_SHOW_LIKES
-                        )
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            text='Изменить информацию',
-                            callback_data=callbacks.MEETINGS_CHANGE
-                        ),
-                        InlineKeyboardButton(
-                            text='Прекратить участие',
-                            callback_data=callbacks.MEETINGS_REMOVE
-                        )
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            text='Назад',
-                            callback_data=callbacks.MEETINGS_STOP
-                        )
-                    ]
-                ],
-                resize_keyboard=True
-            )
+            reply_markup=MEETINGS_MENU_MARKUP
         )
 
         return states.MEETINGS_CHOOSE_ACTION
@@ -704,24 +1166,8 @@ def meetings_start(update, context, text=None):
         reply_or_edit_message(
             update=update,
             context=context,
-            text=(
-                'Чтобы найти новые знакомства на Холодке, сначала необходимо зарегистрироваться — '
-                'написать свое имя и пару слов о себе, а также приложить свое фото или видео, чтобы остальные '
-                'участники могли тебя узнать. После этого можно будет посмотреть на всех остальных и даже поставить '
-                'кому-нибудь лайк!\n\n'
-                'Для начала напиши, как тебя зовут?'
-            ),
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text='Назад',
-                            callback_data=callbacks.MEETINGS_STOP
-                        )
-                    ]
-                ],
-                resize_keyboard=True
-            )
+            text=MEETINGS_REGISTRATION_TEXT,
+            reply_markup=MEETINGS_BACK_MARKUP
         )
         
         return states.MEETINGS_GET_NAME
@@ -741,7 +1187,7 @@ def meetings_name(update, context):
     else:
         context.user_data['meetings_name'] = update.message.text
 
-        context.user_data['meetings_link'] = mention_html(
+        context.user_data['meetings_link'] = cached_mention_html(
             update.effective_user.id,
             context.user_data['meetings_name']
         )
@@ -751,18 +1197,8 @@ def meetings_name(update, context):
         context=context,
         text=(
             'Отлично, теперь пришли свое фото или видео (но не альбом из них)'
-        ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Отмена',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
+        ),
+        reply_markup=MEETINGS_CANCEL_MARKUP
     )
     
     return states.MEETINGS_GET_PHOTO
@@ -792,17 +1228,7 @@ def meetings_photo(update, context):
         text=(
             'И наконец, расскажи немного о себе'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Отмена',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
+        reply_markup=MEETINGS_CANCEL_MARKUP
     )
     
     return states.MEETINGS_GET_BIO
@@ -813,23 +1239,13 @@ def show_user_profile(update, context, force_new_message):
     Send user it's current meetings profile
     """
 
-    if context.user_data.get('meetings_file_type') == types.PHOTO:
-        reply_or_edit_message(
-            update=update,
-            context=context,
-            media=InputMediaPhoto(
-                media=context.user_data.get('meetings_file_id'),
-                caption=context.user_data.get('meetings_caption'),
-                parse_mode='HTML'
-            ),
-            force_new_message=force_new_message
-        )
-    
-    elif context.user_data.get('meetings_file_type') == types.VIDEO:
+    input_media = INPUT_MEDIA.get(context.user_data.get('meetings_file_type'))
+
+    if input_media is not None:
         reply_or_edit_message(
             update=update,
             context=context,
-            media=InputMediaVideo(
+            media=input_media(
                 media=context.user_data.get('meetings_file_id'),
                 caption=context.user_data.get('meetings_caption'),
                 parse_mode='HTML'
@@ -885,21 +1301,7 @@ def meetings_bio(update, context):
         text=(
             'Всё норм, подтверждаешь?'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Да!',
-                        callback_data=callbacks.MEETINGS_CONFIRM_PARTICIPATION
-                    ),
-                    InlineKeyboardButton(
-                        text='Нет 💁‍♂️',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        ),
+        reply_markup=MEETINGS_CONFIRM_PARTICIPATION_MARKUP,
         force_new_message=True
     )
     
@@ -913,20 +1315,13 @@ def meetings_confirm_participation(update, context):
 
     context.user_data['in_meetings'] = True
 
-    # Get current time with actual timezone and convert it to string
-    # with format required by YDB
-    context.user_data['meetings_ts'] = dt.datetime.now(
-        tz=timezone
-    ).replace(
-        tzinfo=None
-    ).isoformat(
-        timespec='microseconds'
-    ) + 'Z'
-
-    ydb_client.update_user_meetings(
-        user_id=update.effective_user.id,
-        meetings_ts=context.user_data['meetings_ts']
-    )
+    context.user_data['meetings_ts'] = get_timestamp()
+
+    # Save meetings timestamp to the database after the update is handled
+    context.user_data['MEETINGS_TS'] = context.user_data['meetings_ts']
+
+    # Profiles order changes, so don't show the cached one
+    meetings_profiles.clear()
 
     return meetings_start(
         update=update,
@@ -950,10 +1345,17 @@ def meetings_show_people(
 
     # Get number of users after or before the corresponding timestamp
     # and the profile of first or last of them
-    num_users, user_data = ydb_client.get_meetings_profile(
-        after_ts=after_ts,
-        before_ts=before_ts
-    )
+    profile = meetings_profiles.get((after_ts, before_ts))
+
+    if profile is None:
+        profile = ydb_client.get_meetings_profile(
+            after_ts=after_ts,
+            before_ts=before_ts
+        )
+
+        meetings_profiles[(after_ts, before_ts)] = profile
+
+    num_users, user_data = profile
 
     if num_users == 0:
         on_top(
@@ -964,15 +1366,10 @@ def meetings_show_people(
 
         return states.END
     
-    elif user_data.get('meetings_file_type') == types.PHOTO:
-        media = InputMediaPhoto(
-            media=user_data.get('meetings_file_id'),
-            caption=user_data.get('meetings_caption'),
-            parse_mode='HTML'
-        )
-    
-    elif user_data.get('meetings_file_type') == types.VIDEO:
-        media = InputMediaVideo(
+    input_media = INPUT_MEDIA.get(user_data.get('meetings_file_type'))
+
+    if input_media is not None:
+        media = input_media(
             media=user_data.get('meetings_file_id'),
             caption=user_data.get('meetings_caption'),
             parse_mode='HTML'
@@ -992,109 +1389,10 @@ def meetings_show_people(
     
     context.user_data['current_meetings_ts'] = user_data.get('meetings_ts')
     
-    # Check what buttons should be on the menu
-    left_button = False
-    right_button = False
-
-    if (after_ts is None) and (before_ts is None):
-        if num_users > 1:
-            right_button = True
-    
-    elif (after_ts is not None) and (before_ts is None):
-        right_button = True
-
-        if num_users > 1:
-            left_button = True
-    
-    elif (after_ts is None) and (before_ts is not None):
-        left_button = True
-
-        if num_users > 1:
-            right_button = True
-
-    else:
-        raise ValueError('after_ts and before_ts could not be not None at the same time')
-    
-    # Build left and right buttons for menu if needed
-    if left_button and right_button:
-        reply_markup = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='‹',
-                        callback_data=callbacks.MEETINGS_SHOW_PEOPLE_LEFT
-                    ),
-                    InlineKeyboardButton(
-                        text='·💜·',
-                        callback_data=callbacks.MEETINGS_LIKE
-                    ),
-                    InlineKeyboardButton(
-                        text='›',
-                        callback_data=callbacks.MEETINGS_SHOW_PEOPLE_RIGHT
-                    ),
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
-    
-    elif left_button:
-        reply_markup = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='‹',
-                        callback_data=callbacks.MEETINGS_SHOW_PEOPLE_LEFT
-                    ),
-                    InlineKeyboardButton(
-                        text='·💜·',
-                        callback_data=callbacks.MEETINGS_LIKE
-                    ),
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
-    
-    elif right_button:
-        reply_markup = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='·💜·',
-                        callback_data=callbacks.MEETINGS_LIKE
-                    ),
-                    InlineKeyboardButton(
-                        text='›',
-                        callback_data=callbacks.MEETINGS_SHOW_PEOPLE_RIGHT
-                    ),
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
-    
-    else:
-        reply_markup = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
+    # Choose menu with left and right buttons if needed
+    reply_markup = MEETINGS_PEOPLE_MARKUPS[
+        MEETINGS_PEOPLE_BUTTONS[(after_ts is not None, before_ts is not None, num_users > 1)]
+    ]
     
     # Send profile and buttons
     reply_or_edit_message(
@@ -1147,8 +1445,9 @@ def meetings_like(update, context):
     try:
         update.callback_query.answer('Лайк записан!')
     
-    except:
-        pass
+    # The like is saved anyway, so only log the failed notification
+    except TelegramError as exception:
+        logger.debug('Could not answer the like callback query: %s', exception)
 
     return states.MEETINGS_CHOOSE_PERSON_ACTION
 
@@ -1158,26 +1457,35 @@ def meetings_show_likes(update, context):
     Send user a message with list of all likes they received and end conversation
     """
 
-    likes = ydb_client.get_like_meetings(
-        like_to_ts=context.user_data.get('meetings_ts')
+    # Get only likes which could fit into one message, along with the number of all of them
+    num_likes, likes = ydb_client.get_like_meetings(
+        like_to_ts=context.user_data.get('meetings_ts'),
+        limit=LIKES_LIMIT
     )
 
-    message = (
-        'Вот кто уже успел поставить тебе лайк:\n\n' + \
-        '\n\n'.join(likes) + \
-        '\n\nЧто хочешь сделать теперь?'
-    )
+    if likes:
+        # Count how many likes fit into one message, so they are joined only once
+        max_length = constants.MAX_MESSAGE_LENGTH - len(LIKES_MENU_TEXT)
+        length = sum(map(len, likes)) + len(LIKES_SEPARATOR) * (len(likes) - 1)
 
-    if len(message) > constants.MAX_MESSAGE_LENGTH:
-        message = (
-            'Тебе поставили уже столько лайков, что они не умещаются в одно сообщение! 😱\n\n'
-            'Поэтому покажу только тех, кто в него уместился:\n\n' + \
-            '\n\n'.join(likes)
-        )[:constants.MAX_MESSAGE_LENGTH - len('\n\nЧто хочешь сделать теперь?')].rpartition('\n\n')[0]
+        if (num_likes == len(likes)) and (len(LIKES_TEXT) + length <= max_length):
+            message = LIKES_TEXT + LIKES_SEPARATOR.join(likes) + LIKES_MENU_TEXT
 
-        message += '\n\nЧто хочешь сделать теперь?'
+        else:
+            max_length -= len(LIKES_OVERFLOW_TEXT)
+            length = -len(LIKES_SEPARATOR)
+            cut = 0
+
+            for like in likes:
+                length += len(LIKES_SEPARATOR) + len(like)
+
+                if length > max_length:
+                    break
+
+                cut += 1
+
+            message = LIKES_OVERFLOW_TEXT + LIKES_SEPARATOR.join(likes[:cut]) + LIKES_MENU_TEXT
 
-    if likes:
         on_top(
             update=update,
             context=context,
@@ -1223,21 +1531,7 @@ def meetings_change(update, context):
         text=(
             'Точно хочешь его поменять?'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Да!',
-                        callback_data=callbacks.MEETINGS_CONFIRM_CHANGE
-                    ),
-                    InlineKeyboardButton(
-                        text='Нет 💁‍♂️',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        ),
+        reply_markup=MEETINGS_CONFIRM_CHANGE_MARKUP,
         force_new_message=True
     )
 
@@ -1255,17 +1549,7 @@ def meetings_confirm_change(update, context):
         text=(
             'Хорошо, для начала напиши, как тебя зовут?'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Отмена',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
+        reply_markup=MEETINGS_CANCEL_MARKUP
     )
     
     return states.MEETINGS_GET_NAME
@@ -1282,21 +1566,7 @@ def meetings_remove(update, context):
         text=(
             'Точно хочешь прекратить участие в знакомствах?'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Да!',
-                        callback_data=callbacks.MEETINGS_CONFIRM_REMOVAL
-                    ),
-                    InlineKeyboardButton(
-                        text='Нет 💁‍♂️',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
+        reply_markup=MEETINGS_CONFIRM_REMOVAL_MARKUP
     )
 
     return states.MEETINGS_GET_REMOVAL_CONFIRMATION
@@ -1309,10 +1579,11 @@ def meetings_confirm_removal(update, context):
 
     context.user_data['in_meetings'] = False
 
-    ydb_client.update_user_meetings(
-        user_id=update.effective_user.id,
-        meetings_ts=False
-    )
+    # Remove meetings timestamp from the database after the update is handled
+    context.user_data['MEETINGS_TS'] = False
+
+    # Profiles order changes, so don't show the cached one
+    meetings_profiles.clear()
 
     on_top(
         update=update,
@@ -1323,13 +1594,10 @@ def meetings_confirm_removal(update, context):
         )
     )
 
-    context.user_data.pop('meetings_name', None)
-    context.user_data.pop('meetings_link', None)
-    context.user_data.pop('meetings_file_type', None)
-    context.user_data.pop('meetings_file_id', None)
-    context.user_data.pop('meetings_bio', None)
-    context.user_data.pop('meetings_caption', None)
-    context.user_data.pop('meetings_ts', None)
+    user_data_pop = context.user_data.pop
+
+    for key in MEETINGS_KEYS:
+        user_data_pop(key, None)
 
     return states.END
 
@@ -1355,17 +1623,7 @@ def meetings_name_too_long(update, context):
         text=(
             'Чересчур длинное у тебя имя получилось. Попробуй написать еще раз покороче'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Отмена',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
+        reply_markup=MEETINGS_CANCEL_MARKUP
     )
 
     return states.MEETINGS_GET_NAME
@@ -1382,17 +1640,7 @@ def meetings_bio_too_long(update, context):
         text=(
             'Чересчур длинное у тебя описание получилось. Попробуй написать еще раз покороче'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Отмена',
-                        callback_data=callbacks.MEETINGS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
+        reply_markup=MEETINGS_CANCEL_MARKUP
     )
 
     return states.MEETINGS_GET_BIO
@@ -1403,21 +1651,10 @@ def camps_start(update, context):
     Show camps description
     """
 
-    message_1 = (
-        'Список всех лагерей на Холодке вместе с их описаниями:\n\n•' + \
-        '\n•'.join(map(lambda camp: f'<a href="{camp[1]}">{camp[0]}</a>', camps_data[:len(camps_data) // 2]))
-    )
-
-    message_2 = (
-        '•' + \
-        '\n•'.join(map(lambda camp: f'<a href="{camp[1]}">{camp[0]}</a>', camps_data[len(camps_data) // 2:]))
-    )
-
-
     reply_or_edit_message(
         update=update,
         context=context,
-        text=message_1,
+        text=CAMPS_TEXT_1,
         reply_markup=None,
         parse_mode='HTML',
         disable_web_page_preview=True
@@ -1426,18 +1663,8 @@ def camps_start(update, context):
     reply_or_edit_message(
         update=update,
         context=context,
-        text=message_2,
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.CAMPS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        ),
+        text=CAMPS_TEXT_2,
+        reply_markup=CAMPS_BACK_MARKUP,
         parse_mode='HTML',
         disable_web_page_preview=True,
         force_new_message=True
@@ -1456,99 +1683,105 @@ def camps_stop(update, context):
     )
 
 
-def timetable_start(update, context):
+def get_timetable_messages() -> tuple:
     """
-    Show current activities
+    Build timetable for the next hours as one message
+    or as two halves, if it doesn't fit into one
     """
 
-    from_ts = dt.datetime.now(
-        tz=timezone
-    ).replace(
-        tzinfo=None
-    ).isoformat(
-        timespec='microseconds'
-    ) + 'Z'
-    
-    to_ts = (
-        dt.datetime.now(
-            tz=timezone
-        ).replace(
-            tzinfo=None
-        ) + dt.timedelta(hours=TIMETABLE_PERIOD_HOURS)
-    ).isoformat(
-        timespec='microseconds'
-    ) + 'Z'
+    # Take current time once, so both ends of the period are consistent
+    now_ns = time.time_ns()
+
+    from_ts = get_timestamp(now_ns=now_ns)
+
+    to_ts = get_timestamp(
+        delta_seconds=TIMETABLE_PERIOD_SECONDS,
+        now_ns=now_ns
+    )
 
     rows = ydb_client.get_timetable(
         from_ts=from_ts,
         to_ts=to_ts
     )
 
-    message = ''
+    # Collect message parts and remember where each camp starts,
+    # so the message is joined once and split without searching
+    parts = [TIMETABLE_TEXT]
+    length = len(TIMETABLE_TEXT)
+    camp_offsets = []
     last_camp = None
+    localtime = time.localtime
 
     for row in rows:
-        start = getattr(row, ydb_client.start_column)
-        end = getattr(row, ydb_client.end_column)
+        start = localtime(getattr(row, ydb_client.start_column) // 10**6)
+        end = localtime(getattr(row, ydb_client.end_column) // 10**6)
         camp = getattr(row, ydb_client.camp_column)
         description = getattr(row, ydb_client.description_column)
         link = getattr(row, ydb_client.link_column)
 
         if last_camp == camp:
-            message += (
-                f'\n<b>{dt.datetime.fromtimestamp(start // 10**6).strftime("%H:%M")}</b>—'
-                f'<b>{dt.datetime.fromtimestamp(end // 10**6).strftime("%H:%M")}</b>: '
-                f'{description}'
-            )
+            part = '\n'
         
         else:
-            message += (
-                f'\n\n<a href="{link}">{camp}</a>:\n'
-                f'<b>{dt.datetime.fromtimestamp(start // 10**6).strftime("%H:%M")}</b>—'
-                f'<b>{dt.datetime.fromtimestamp(end // 10**6).strftime("%H:%M")}</b>: '
-                f'{description}'
-            )
-        
+            camp_offsets.append(length)
+            part = f'\n\n<a href="{link}">{camp}</a>:\n'
+
+        part += (
+            f'<b>{start.tm_hour:02d}:{start.tm_min:02d}</b>—'
+            f'<b>{end.tm_hour:02d}:{end.tm_min:02d}</b>: '
+            f'{description}'
+        )
+
+        parts.append(part)
+        length += len(part)
         last_camp = camp
     
-    if message == '':
-        message = 'В расписании в ближайшее время ничего нет, но в реальности наверняка что-то происходит!'
+    if camp_offsets:
+        message = ''.join(parts)
     
     else:
-        message = (
-            'По расписанию на Холодке работает только столовая, но примерно в '
-            f'ближайшие {TIMETABLE_PERIOD_HOURS} часа можно ожидать следующего (полное расписание '
-            'лагерей по ссылкам):' + message
-        )
+        message = TIMETABLE_EMPTY_TEXT
     
     if len(message) <= constants.MAX_MESSAGE_LENGTH:
+        return (message,)
+    
+    # Split at the first camp in the second half of the message
+    split = next(
+        (offset for offset in camp_offsets if offset >= length // 2),
+        camp_offsets[-1]
+    )
+
+    return (message[:split], message[split:].strip())
+
+
+def timetable_start(update, context):
+    """
+    Show current activities
+    """
+
+    # Timetable is the same for all users, so build it once for a short period
+    messages = timetable_messages.get(TIMETABLE_CACHE_KEY)
+
+    if messages is None:
+        messages = get_timetable_messages()
+
+        timetable_messages[TIMETABLE_CACHE_KEY] = messages
+
+    if len(messages) == 1:
         reply_or_edit_message(
             update=update,
             context=context,
-            text=message,
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text='Назад',
-                            callback_data=callbacks.TIMETABLE_STOP
-                        )
-                    ]
-                ],
-                resize_keyboard=True
-            ),
+            text=messages[0],
+            reply_markup=TIMETABLE_BACK_MARKUP,
             parse_mode='HTML',
             disable_web_page_preview=True
         )
     
     else:
-        message_1 = message[:message.find('\n\n', len(message) // 2)]
-        message_2 = message[message.find('\n\n', len(message) // 2):].strip()
-
         reply_or_edit_message(
             update=update,
             context=context,
-            text=message_1,
+            text=messages[0],
             reply_markup=None,
             parse_mode='HTML',
             disable_web_page_preview=True
@@ -1557,18 +1790,8 @@ def timetable_start(update, context):
         reply_or_edit_message(
             update=update,
             context=context,
-            text=message_2,
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text='Назад',
-                            callback_data=callbacks.TIMETABLE_STOP
-                        )
-                    ]
-                ],
-                resize_keyboard=True
-            ),
+            text=messages[1],
+            reply_markup=TIMETABLE_BACK_MARKUP,
             parse_mode='HTML',
             disable_web_page_preview=True,
             force_new_message=True
@@ -1597,29 +1820,11 @@ def map_start(update, context):
         context=context,
         text=None,
         media=InputMediaDocument(
-            media=os.getenv('MAP_DOCUMENT_ID'),
-            caption=(
-                'Карту Холодка можно посмотреть сразу в двух вариантах: '
-                f'интерактивную на <a href="{os.getenv("MAP_LINK")}">Google Maps</a> или '
-                'статичную, но очень красивую в виде вот такого изображения ↑\n\n'
-                'Чтобы построить маршрут на карте, откройте ссылку на Google Maps, '
-                'затем нажмите слева вверху символ меню, выберете в списке нужный вам кэмп '
-                'и наконец вверху страницы справа от названия кэмпа нажмите на стрелку вправо, '
-                'тогда Google построит маршрут от вашего местоположения до этого места'
-            ),
+            media=MAP_DOCUMENT_ID,
+            caption=MAP_CAPTION,
             parse_mode='HTML'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.MAP_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        )
+        reply_markup=MAP_BACK_MARKUP
     )
 
 
@@ -1639,21 +1844,8 @@ def shuttle_start(update, context):
     reply_or_edit_message(
         update=update,
         context=context,
-        text=(
-            'Текущую геолокацию шаттла между «Дружбой» и «Зеленым городком» можно найти в '
-            f'<a href="{os.getenv("SHUTTLE_LINK")}">данном сообщении</a> канала «Холодок: Объявления»'
-        ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.SHUTTLE_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        ),
+        text=SHUTTLE_TEXT,
+        reply_markup=SHUTTLE_BACK_MARKUP,
         parse_mode='HTML'
     )
 
@@ -1674,21 +1866,8 @@ def shelter_start(update, context):
     reply_or_edit_message(
         update=update,
         context=context,
-        text=(
-            f'Послушать радио <a href="https://telegra.ph/Piratskoe-radio-SHalashFM-02-19">'
-            f'лагеря ШалашFM</a> можно на волне 93.0 FM или по следующей ссылке: {os.getenv("SHELTER_LINK")}'
-        ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.SHELTER_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        ),
+        text=SHELTER_TEXT,
+        reply_markup=SHELTER_BACK_MARKUP,
         parse_mode='HTML',
         disable_web_page_preview=True
     )
@@ -1714,21 +1893,7 @@ def mortuary_start(update, context):
             'Лагерь «<a href="https://telegra.ph/PogrebalNYA-i-Dushnyj-bar-02-19">ПогребальНЯ и Душный бар</a>» '
             '(«Дружба», корпус 2) предлагает вам подборку «<i>смертельных мемов</i>» — не плакать же по этому поводу!'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Показать мем',
-                        callback_data=callbacks.MORTUARY_SHOW_MEME
-                    ),
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.MORTUARY_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        ),
+        reply_markup=MORTUARY_MENU_MARKUP,
         parse_mode='HTML',
         disable_web_page_preview=True
     )
@@ -1744,11 +1909,13 @@ def mortuary_show_meme(update, context):
     # New meme
     meme = None
 
-    # Memes user already has seen
+    # Memes user already has seen, kept as a list since user data is saved as JSON,
+    # but checked as a set
     seen = context.user_data.get('seen_memes', [])
+    seen_set = set(seen)
 
     # Leftover memes
-    unseen = list(filter(lambda meme: meme[1] not in seen, memes_data))
+    unseen = [meme for meme in memes_data if meme[1] not in seen_set]
 
     if unseen:
         # Choose random meme
@@ -1764,21 +1931,7 @@ def mortuary_show_meme(update, context):
                 '«<a href="https://telegra.ph/PogrebalNYA-i-Dushnyj-bar-02-19">Погребальню</a>», '
                 'или можете посмотреть все мемы еще раз'
             ),
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text='Начать заново',
-                            callback_data=callbacks.MORTUARY_START_OVER
-                        ),
-                        InlineKeyboardButton(
-                            text='Назад',
-                            callback_data=callbacks.MORTUARY_STOP
-                        )
-                    ]
-                ],
-                resize_keyboard=True
-            ),
+            reply_markup=MORTUARY_START_OVER_MARKUP,
             parse_mode='HTML',
             disable_web_page_preview=True
         )
@@ -1786,58 +1939,21 @@ def mortuary_show_meme(update, context):
         return states.MORTUARY_CHOOSE_ACTION
     
     # Send meme depending on its type
-    reply_markup = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text='Показать мем',
-                    callback_data=callbacks.MORTUARY_SHOW_MEME
-                ),
-                InlineKeyboardButton(
-                    text='Назад',
-                    callback_data=callbacks.MORTUARY_STOP
-                )
-            ]
-        ],
-        resize_keyboard=True
-    )
+    input_media = INPUT_MEDIA.get(meme[0])
 
-    if meme[0] == types.ANIMATION:
-        reply_or_edit_message(
-            update=update,
-            context=context,
-            media=InputMediaAnimation(
-                media=meme[1],
-                caption=meme[2]
-            ),
-            reply_markup=reply_markup
-        )
-    
-    elif meme[0] == types.PHOTO:
-        reply_or_edit_message(
-            update=update,
-            context=context,
-            media=InputMediaPhoto(
-                media=meme[1],
-                caption=meme[2]
-            ),
-            reply_markup=reply_markup
-        )
-    
-    elif meme[0] == types.VIDEO:
-        reply_or_edit_message(
-            update=update,
-            context=context,
-            media=InputMediaVideo(
-                media=meme[1],
-                caption=meme[2]
-            ),
-            reply_markup=reply_markup
-        )
-    
-    else:
+    if input_media is None:
         raise ValueError(f'Unknown meme type = {meme[0]}')
 
+    reply_or_edit_message(
+        update=update,
+        context=context,
+        media=input_media(
+            media=meme[1],
+            caption=meme[2]
+        ),
+        reply_markup=MORTUARY_MENU_MARKUP
+    )
+
     # Check this meme has been seen
     seen.append(meme[1])
     context.user_data['seen_memes'] = seen
@@ -1870,25 +1986,11 @@ def principles_start(update, context):
     Send description of Burning Man principles and menu with paginated list of all of them
     """
 
-    paginator = InlineKeyboardPaginator(
-        page_count=len(principles_data),
-        current_page=None,
-        current_page_format=False,
-        data_pattern=callbacks.PRINCIPLES_PAGE + '#{page}'
-    )
-
-    paginator.add_after(
-        InlineKeyboardButton(
-            text='Назад',
-            callback_data=callbacks.PRINCIPLES_STOP
-        )
-    )
-
     reply_or_edit_message(
         update=update,
         context=context,
         text=principles_description,
-        reply_markup=paginator.markup,
+        reply_markup=PRINCIPLES_START_MARKUP,
         parse_mode='HTML'
     )
 
@@ -1902,24 +2004,11 @@ def principles_page(update, context):
 
     page = int(update.callback_query.data.split('#')[1])
 
-    paginator = InlineKeyboardPaginator(
-        page_count=len(principles_data),
-        current_page=page,
-        data_pattern=callbacks.PRINCIPLES_PAGE + '#{page}'
-    )
-
-    paginator.add_after(
-        InlineKeyboardButton(
-            text='Назад',
-            callback_data=callbacks.PRINCIPLES_STOP
-        )
-    )
-
     reply_or_edit_message(
         update=update,
         context=context,
         text=principles_data[page - 1],
-        reply_markup=paginator.markup,
+        reply_markup=PRINCIPLES_PAGE_MARKUPS[page],
         parse_mode='HTML'
     )
 
@@ -1950,17 +2039,7 @@ def sos_start(update, context):
             'передавать информацию через чаты, рации или с помощью лагеря '
             '«<a href="https://telegra.ph/Pochtovaya-sluzhba-Vezdehody-02-19">Вездеходы</a>» 📬'
         ),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text='Назад',
-                        callback_data=callbacks.SOS_STOP
-                    )
-                ]
-            ],
-            resize_keyboard=True
-        ),
+        reply_markup=SOS_BACK_MARKUP,
         parse_mode='HTML',
         disable_web_page_preview=True
     )
@@ -1989,13 +2068,10 @@ def on_unknown(update, context):
     )
 
     # Remove post channel data if present
-    context.user_data.pop('post_channel_message', None)
-    context.user_data.pop('post_channel_message_type', None)
-    context.user_data.pop('post_channel_file_id', None)
-    context.user_data.pop('post_channel_full_message', None)
-    context.user_data.pop('post_channel_public_footer', None)
-    context.user_data.pop('post_channel_private_footer', None)
-    context.user_data.pop('post_channel_footer_max_length', None)
+    user_data_pop = context.user_data.pop
+
+    for key in POST_CHANNEL_KEYS:
+        user_data_pop(key, None)
 
     # In case it was a conversation, save the error to end all of them
     context.user_data['UNKNOWN'] = True
@@ -2003,12 +2079,14 @@ def on_unknown(update, context):
 
 def on_every(update, context):
     """
-    Increment user's bot usage data after processing an update
+    Increment user's bot usage data and save meetings timestamp if it was changed
+    after processing an update
     """
 
     # TO DO: Check for missing user_id (channel and pool events)
-    ydb_client.update_usage(
-        user_id=update.effective_user.id
+    ydb_client.update_user_state(
+        user_id=update.effective_user.id,
+        meetings_ts=context.user_data.pop('MEETINGS_TS', None)
     )
 
     # Log action
@@ -2028,7 +2106,29 @@ def on_every(update, context):
     else:
         action = 'other'
 
-    logger.info(f'Processed action: {action}')
+    logger.info('Processed action: %s', action)
+
+
+@lru_cache(maxsize=256)
+def format_exception_message(
+    exception_type,
+    exception_str
+    ) -> str:
+    """
+    Format the last line of a traceback as traceback.format_exception_only does,
+    so the same errors repeated during an outage are formatted once
+    """
+
+    name = exception_type.__qualname__
+    module = exception_type.__module__
+
+    if module not in ('__main__', 'builtins'):
+        name = f'{module}.{name}'
+
+    if not exception_str:
+        return f'{name}\n'
+
+    return f'{name}: {exception_str}\n'
 
 
 def on_error(update, context):
@@ -2041,29 +2141,47 @@ def on_error(update, context):
         exc_info=context.error
     )
 
-    # Convert error messages from lists to to strings
-    exception_msg = ''.join(traceback.format_exception_only(None, context.error))
+    # Notify the developer only if there is one to notify,
+    # otherwise skip formatting the message at all
+    if DEVELOPER_ID is not None:
+        # Convert error messages from lists to to strings
+        exception_msg = format_exception_message(
+            exception_type=type(context.error),
+            exception_str=str(context.error)
+        )
+
+        traceback_msg = ''.join(traceback.format_exception(None, context.error, context.error.__traceback__))
 
-    traceback_msg = ''.join(traceback.format_exception(None, context.error, context.error.__traceback__))
+        update_str = update.to_dict() if isinstance(update, Update) else str(update)
 
-    update_str = update.to_dict() if isinstance(update, Update) else str(update)
+        # orjson keeps non-ASCII characters as is and returns bytes.
+        # Indents are dropped to fit more data into one message
+        update_json = orjson.dumps(
+            update_str,
+            default=str
+        ).decode()
 
-    # Build a message to the developer with all relevant information
-    # and clip it to fit the error with closing </pre> tag in one message
-    message = (
-        f'An exception was raised while handling an update:\n\n'
-        f'<pre>update = {html.escape(json.dumps(update_str, indent=2, ensure_ascii=False))}\n\n'
-        f'context.chat_data = {html.escape(str(context.chat_data))}\n\n'
-        f'context.user_data = {html.escape(str(context.user_data))}\n\n'
-        f'exception = {html.escape(exception_msg)}\n\n'
-        f'{html.escape(traceback_msg)}'
-    )[:constants.MAX_MESSAGE_LENGTH - 6] + '</pre>'
+        # Build a message to the developer with all relevant information,
+        # escape everything within <pre> tag at once
+        # and clip it to fit the error with closing </pre> tag in one message.
+        # Quotes need no escaping in the tag body, and JSON is full of them
+        message = (
+            'An exception was raised while handling an update:\n\n<pre>' + \
+            html.escape(
+                f'update = {update_json}\n\n'
+                f'context.chat_data = {context.chat_data}\n\n'
+                f'context.user_data = {context.user_data}\n\n'
+                f'exception = {exception_msg}\n\n'
+                f'{traceback_msg}',
+                quote=False
+            )
+        )[:constants.MAX_MESSAGE_LENGTH - 6] + '</pre>'
 
-    # Send message to the developer
-    notify_developer(
-        message=message,
-        context=context
-    )
+        # Send message to the developer
+        notify_developer(
+            message=message,
+            context=context
+        )
 
     # Send message to the user
     update.effective_message.reply_text(
@@ -2077,31 +2195,16 @@ def on_error(update, context):
 
 def on_media(update, context):
 
-    # Animation should be checked before document
-    if update.message.animation is not None:
-        message_type = types.ANIMATION
-        message_file_id = update.message.animation.file_id
+    message_type, media = get_message_media(update.message)
 
-    elif update.message.audio is not None:
-        message_type = types.AUDIO
-        message_file_id = update.message.audio.file_id
-    
-    elif update.message.document is not None:
-        message_type = types.DOCUMENT
-        message_file_id = update.message.document.file_id
+    if message_type is None:
+        return on_unknown(update, context)
 
-    # Photo attribute is a possibly empty list
-    elif update.message.photo:
-        message_type = types.PHOTO
-        # Photo is a list of telegram.PhotoSize with available sizes of the photo
-        message_file_id = update.message.photo[0].file_id
+    # Photo is a list of telegram.PhotoSize with available sizes of the photo
+    if message_type == types.PHOTO:
+        media = media[0]
 
-    elif update.message.video is not None:
-        message_type = types.VIDEO
-        message_file_id = update.message.video.file_id
-    
-    else:
-        return on_unknown(update, context)
+    message_file_id = media.file_id
 
     on_top(
         update=update,
@@ -2148,29 +2251,13 @@ def add_handlers(dispatcher):
             states={
                 states.POST_CHANNEL_GET_MESSAGE: [
                     MessageHandler(
-                        filters=(
-                            # Text or media with captions without groups
-                            (
-                                (Filters.text & (~Filters.command)) |
-                                Filters.animation |
-                                Filters.audio |
-                                Filters.document |
-                                Filters.photo |
-                                Filters.video
-                            ) & (
-                                ~fiter_media_group
-                            )
-                        ),
+                        filters=POST_CHANNEL_MESSAGE_FILTER,
                         callback=post_channel_message
                     )
                 ],
                 states.POST_CHANNEL_GET_PRIVACY: [
                     CallbackQueryHandler(
-                        pattern=(
-                            f'^{callbacks.POST_CHANNEL_PUBLIC}$'
-                            '|'
-                            f'^{callbacks.POST_CHANNEL_PRIVATE}$'
-                        ),
+                        pattern=f'^(?:{callbacks.POST_CHANNEL_PUBLIC}|{callbacks.POST_CHANNEL_PRIVATE})$',
                         callback=post_channel_privacy
                     )
                 ],
@@ -2212,30 +2299,19 @@ def add_handlers(dispatcher):
             states={
                 states.MEETINGS_GET_NAME: [
                     MessageHandler(
-                        filters=(
-                            Filters.text & (~Filters.command)
-                        ),
+                        filters=TEXT_FILTER,
                         callback=meetings_name
                     )
                 ],
                 states.MEETINGS_GET_PHOTO:  [
                     MessageHandler(
-                        filters=(
-                            (
-                                Filters.photo |
-                                Filters.video
-                            ) & (
-                                ~fiter_media_group
-                            )
-                        ),
+                        filters=MEETINGS_MEDIA_FILTER,
                         callback=meetings_photo
                     )
                 ],
                 states.MEETINGS_GET_BIO: [
                     MessageHandler(
-                        filters=(
-                            Filters.text & (~Filters.command)
-                        ),
+                        filters=TEXT_FILTER,
                         callback=meetings_bio
                     )
                 ],
@@ -2517,19 +2593,7 @@ def add_handlers(dispatcher):
     # OTHER
     dispatcher.add_handler(
         MessageHandler(
-            filters=(
-                (
-                    Filters.caption(['симсалабим'])
-                ) & (
-                    Filters.animation |
-                    Filters.audio |
-                    Filters.document |
-                    Filters.photo |
-                    Filters.video
-                ) & (
-                    ~fiter_media_group
-                )
-            ),
+            filters=MAGIC_MEDIA_FILTER,
             callback=on_media
         )
     )
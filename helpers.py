@@ -1,26 +1,85 @@
 import logging
 import os
 import sys
+import time
+from collections import deque
 from telegram import (
     InputMediaAnimation,
     InputMediaAudio,
     InputMediaDocument,
     InputMediaPhoto,
-    InputMediaVideo
+    InputMediaVideo,
+    Message
+)
+from telegram.error import (
+    BadRequest,
+    TelegramError,
+    TimedOut
 )
-from telegram.error import BadRequest
 from telegram.ext import MessageFilter
 from telegram.utils.helpers import mention_html
 
 
 logger = logging.getLogger()
 
+# Telegram chat of the developer to notify, if any
+DEVELOPER_ID = os.getenv('DEVELOPER_ID')
+
+# Send at most the limit of messages to the developer within the period,
+# so a burst of errors doesn't make every handler wait for Telegram
+NOTIFICATIONS_LIMIT = 10
+NOTIFICATIONS_PERIOD_SECONDS = 60
+
+# Don't let a slow message to the developer stall the update
+NOTIFICATIONS_TIMEOUT_SECONDS = 2
+
+notifications_ts = deque(maxlen=NOTIFICATIONS_LIMIT)
+
+# Narrow Python builds index strings by UTF-16 code units as Telegram does,
+# otherwise message text should be encoded to UTF-16 to use entities offsets
+NARROW_UNICODE = sys.maxunicode == 0xffff
+
+# Message methods to reply with the media of the corresponding class,
+# taking the media as the first argument
+MEDIA_REPLIES = {
+    InputMediaAnimation: Message.reply_animation,
+    InputMediaAudio: Message.reply_audio,
+    InputMediaDocument: Message.reply_document,
+    InputMediaPhoto: Message.reply_photo,
+    InputMediaVideo: Message.reply_video
+}
+
+# Functions to format entity text in HTML parse mode by entity type
+ENTITY_FORMATS = {
+    'bold': lambda text, entity: f'<b>{text}</b>',
+    'italic': lambda text, entity: f'<i>{text}</i>',
+    'underline': lambda text, entity: f'<u>{text}</u>',
+    'strikethrough': lambda text, entity: f'<s>{text}</s>',
+    'spoiler': lambda text, entity: f'<tg-spoiler>{text}</tg-spoiler>',
+    'url': lambda text, entity: f'<a href="{text}">{text}</a>',
+    'mention': lambda text, entity: f'<a href="https://t.me/{text.strip("@")}">{text}</a>',
+    'text_link': lambda text, entity: (
+        text if entity.url is None else f'<a href="{entity.url}">{text}</a>'
+    ),
+    'text_mention': lambda text, entity: (
+        text if entity.user is None else f'<a href="tg://user?id={entity.user.id}">{text}</a>'
+    ),
+    'code': lambda text, entity: f'<code>{text}</code>',
+    'pre': lambda text, entity: (
+        f'<pre>{text}</pre>' if entity.language is None
+        else f'<pre><code class="{entity.language}">{text}</code></pre>'
+    )
+}
+
 
 class FilterMediaGroup(MessageFilter):
     """
     Custom filter for messages that are part of a media group
     """
 
+    # Filter keeps no state, as PTB filters do
+    __slots__ = ()
+
     def filter(self, message):
         return message.media_group_id is not None
 
@@ -42,67 +101,39 @@ def decode_entities(
     if not entities:
         return message_text
 
-    if not sys.maxunicode == 0xffff:
+    if not NARROW_UNICODE:
         message_text = message_text.encode('utf-16-le')
 
-    html_text = ''
+    # Collect text parts and join them once in the end
+    parts = []
     last_offset = 0
 
     for entity, text in sorted(entities.items(), key=(lambda item: item[0].offset)):
-        if entity.type == 'bold':
-            insert = f'<b>{text}</b>'
-        
-        elif entity.type == 'italic':
-            insert = f'<i>{text}</i>'
-        
-        elif entity.type == 'underline':
-            insert = f'<u>{text}</u>'
-
-        elif entity.type == 'strikethrough':
-            insert = f'<s>{text}</s>'
-        
-        elif entity.type == 'spoiler':
-            insert = f'<tg-spoiler>{text}</tg-spoiler>'
-
-        elif entity.type == 'url':
-            insert = f'<a href="{text}">{text}</a>'
-        
-        elif entity.type == 'mention':
-            insert = f'<a href="https://t.me/{text.strip("@")}">{text}</a>'
-
-        elif (entity.type == 'text_link') and (entity.url is not None):
-            insert = f'<a href="{entity.url}">{text}</a>'
-        
-        elif (entity.type == 'text_mention') and (entity.user is not None):
-            insert = f'<a href="tg://user?id={entity.user.id}">{text}</a>'
-        
-        elif entity.type == 'code':
-            insert = f'<code>{text}</code>'
-        
-        elif (entity.type == 'pre') and (entity.language is None):
-            insert = f'<pre>{text}</pre>'
+        format_entity = ENTITY_FORMATS.get(entity.type)
 
-        elif (entity.type == 'pre') and (entity.language is not None):
-            insert = f'<pre><code class="{entity.language}">{text}</code></pre>'
+        if format_entity is None:
+            insert = text
         
         else:
-            insert = text
+            insert = format_entity(text, entity)
         
-        if sys.maxunicode == 0xffff:
-            html_text += message_text[last_offset : entity.offset] + insert
+        if NARROW_UNICODE:
+            parts.append(message_text[last_offset : entity.offset])
         
         else:
-            html_text += message_text[last_offset * 2:entity.offset * 2].decode('utf-16-le') + insert
+            parts.append(message_text[last_offset * 2:entity.offset * 2].decode('utf-16-le'))
+
+        parts.append(insert)
 
         last_offset = entity.offset + entity.length
 
-    if sys.maxunicode == 0xffff:
-        html_text += message_text[last_offset:]
+    if NARROW_UNICODE:
+        parts.append(message_text[last_offset:])
     
     else:
-        html_text += message_text[last_offset * 2:].decode('utf-16-le')
+        parts.append(message_text[last_offset * 2:].decode('utf-16-le'))
     
-    return html_text
+    return ''.join(parts)
 
 
 def notify_developer(
@@ -115,18 +146,36 @@ def notify_developer(
     Either bot or context should not be None
     """
 
+    # There is no one to notify
+    if DEVELOPER_ID is None:
+        return None
+
+    now = time.monotonic()
+
+    # The oldest of the last sent messages is within the period, so skip this one
+    if (
+        (len(notifications_ts) == NOTIFICATIONS_LIMIT) and
+        (now - notifications_ts[0] < NOTIFICATIONS_PERIOD_SECONDS)
+    ):
+        logger.error('Too many messages to the developer, skipped the message: %s', message)
+
+        return None
+    
+    notifications_ts.append(now)
+
     if bot is None:
         bot = context.bot
 
     try:
         bot.send_message(
-            chat_id=os.getenv('DEVELOPER_ID'),
+            chat_id=DEVELOPER_ID,
             text=message,
-            parse_mode='HTML'
+            parse_mode='HTML',
+            timeout=NOTIFICATIONS_TIMEOUT_SECONDS
         )
 
     except:
-        logger.exception(f'Could not send to the developer the message: {message}')
+        logger.exception('Could not send to the developer the message: %s', message)
 
 
 def reply_message(
@@ -151,61 +200,28 @@ def reply_message(
                 disable_web_page_preview=disable_web_page_preview
             )
         
-        elif isinstance(media, InputMediaAnimation):
-            update.effective_message.reply_animation(
-                animation=media.media,
-                caption=getattr(media, 'caption', None),
-                reply_markup=reply_markup,
-                parse_mode=getattr(media, 'parse_mode', None)
-            )
-        
-        elif isinstance(media, InputMediaAudio):
-            update.effective_message.reply_audio(
-                audio=media.media,
-                caption=getattr(media, 'caption', None),
-                reply_markup=reply_markup,
-                parse_mode=getattr(media, 'parse_mode', None)
-            )
-
-        elif isinstance(media, InputMediaDocument):
-            update.effective_message.reply_document(
-                document=media.media,
-                caption=getattr(media, 'caption', None),
-                reply_markup=reply_markup,
-                parse_mode=getattr(media, 'parse_mode', None)
-            )
-
-        elif isinstance(media, InputMediaPhoto):
-            update.effective_message.reply_photo(
-                photo=media.media,
-                caption=getattr(media, 'caption', None),
-                reply_markup=reply_markup,
-                parse_mode=getattr(media, 'parse_mode', None)
-            )
-        
-        elif isinstance(media, InputMediaVideo):
-            update.effective_message.reply_video(
-                video=media.media,
-                caption=getattr(media, 'caption', None),
-                reply_markup=reply_markup,
-                parse_mode=getattr(media, 'parse_mode', None)
-            )
-        
         else:
-            notify_developer(
-                text=f'Unknown message type, media = {media}, message = {update.effective_message}',
-                context=context
-            )
-    
-    except Exception as exception:
-        logger.warning(f'Encountered telegram.error: {exception}')
+            media_reply = MEDIA_REPLIES.get(type(media))
 
-        # In case of time out do nothing
-        if 'Timed out' in str(exception):
-            pass
-        
-        else:
-            raise exception
+            if media_reply is None:
+                notify_developer(
+                    message=f'Unknown message type, media = {media}, message = {update.effective_message}',
+                    context=context
+                )
+            
+            else:
+                # Caption and parse mode attributes are not set if they are missing
+                media_reply(
+                    update.effective_message,
+                    media.media,
+                    caption=getattr(media, 'caption', None),
+                    reply_markup=reply_markup,
+                    parse_mode=getattr(media, 'parse_mode', None)
+                )
+    
+    # In case of time out do nothing
+    except TimedOut as exception:
+        logger.warning('Encountered telegram.error: %s', exception)
 
 
 def reply_or_edit_message(
@@ -243,7 +259,7 @@ def reply_or_edit_message(
     try:
         update.callback_query.answer()
 
-    except:
+    except TelegramError:
         pass
 
     # If we specifically asked to send a new message, do it and exit
@@ -268,19 +284,17 @@ def reply_or_edit_message(
                 disable_web_page_preview=disable_web_page_preview
             )
         
-        except Exception as exception:
-            logger.warning(f'Encountered telegram.error: {exception}')
-
-            # In case message is not modified or time out do nothing
-            if (
-                ('Message is not modified' in str(exception)) or
-                ('Timed out' in str(exception))
-            ):
-                pass
-            
-            # In case of error (message not found / query is too old or invalid / etc)
+        # In case of time out do nothing
+        except TimedOut as exception:
+            logger.warning('Encountered telegram.error: %s', exception)
+
+        except TelegramError as exception:
+            logger.warning('Encountered telegram.error: %s', exception)
+
+            # In case message is not modified do nothing,
+            # in case of other error (message not found / query is too old or invalid / etc)
             # try to send a new message instead
-            else:
+            if not (isinstance(exception, BadRequest) and ('Message is not modified' in exception.message)):
                 reply_message(
                     update=update,
                     context=context,
@@ -299,19 +313,17 @@ def reply_or_edit_message(
                 reply_markup=reply_markup
             )
         
-        except Exception as exception:
-            logger.warning(f'Encountered telegram.error: {exception}')
-
-            # In case message is not modified do nothing
-            if (
-                ('Message is not modified' in str(exception)) or
-                ('Timed out' in str(exception))
-            ):
-                pass
-            
-            # In case of error (message not found / query is too old or invalid / etc)
+        # In case of time out do nothing
+        except TimedOut as exception:
+            logger.warning('Encountered telegram.error: %s', exception)
+
+        except TelegramError as exception:
+            logger.warning('Encountered telegram.error: %s', exception)
+
+            # In case message is not modified do nothing,
+            # in case of other error (message not found / query is too old or invalid / etc)
             # try to send a new message instead
-            else:
+            if not (isinstance(exception, BadRequest) and ('Message is not modified' in exception.message)):
                 reply_message(
                     update=update,
                     context=context,
@@ -328,7 +340,7 @@ def reply_or_edit_message(
         try:
             update.callback_query.delete_message()
         
-        except:
+        except TelegramError:
             pass
         
         # Send a new one
@@ -348,7 +360,7 @@ def reply_or_edit_message(
         try:
             update.callback_query.delete_message()
         
-        except:
+        except TelegramError:
             pass
 
         reply_message(
@@ -1,7 +1,10 @@
 import logging
+import orjson
 import os
-import ujson as json
-from handlers import add_handlers
+from handlers import (
+    add_handlers,
+    is_stateless_update
+)
 from helpers import notify_developer
 from persistence import (
     PersistentDispatcher,
@@ -11,6 +14,7 @@ from telegram import (
     Bot,
     Update
 )
+from telegram.utils.request import Request
 from warnings import filterwarnings
 
 # Enable logging
@@ -23,15 +27,19 @@ filterwarnings(
     message=r'.*CallbackQueryHandler'
 )
 
+# Keep a few connections to Telegram open in a warm instance,
+# so sends from more than one thread don't wait for a new TLS handshake
+TELEGRAM_POOL_SIZE = 4
+
 # Define responses
 OK_RESPONSE = {
     'statusCode': 200,
-    'body': json.dumps('OK')
+    'body': orjson.dumps('OK').decode()
 }
 
 ERROR_RESPONSE = {
     'statusCode': 400,
-    'body': json.dumps('ERROR')
+    'body': orjson.dumps('ERROR').decode()
 }
 
 
@@ -47,7 +55,14 @@ def configure_telegram():
     if BOT_TOKEN is None:
         raise NotImplementedError('No BOT_TOKEN found')
     
-    return Bot(BOT_TOKEN)
+    return Bot(
+        token=BOT_TOKEN,
+        request=Request(
+            con_pool_size=TELEGRAM_POOL_SIZE,
+            connect_timeout=5,
+            read_timeout=10
+        )
+    )
 
 
 # Initialize bot and dispatcher to register handlers
@@ -68,43 +83,51 @@ def process_update(event, context):
     Receive a message as an event via Telegram webhook and send a response
     """
     
-    logger.info(f'Event received: {event}')
+    # Format the event only if the message is logged
+    logger.info('Event received: %s', event)
 
     try:
         # Convert event to an Update instance
         update = Update.de_json(
-            data=json.loads(event.get('body')),
+            data=orjson.loads(event.get('body')),
             bot=bot
         )
     
     except:
-        message = f'Could not convert event {event} to an Update instance'
-
-        logger.exception(message)
+        logger.exception('Could not convert event %s to an Update instance', event)
         
         notify_developer(
-            message=message,
+            message=f'Could not convert event {event} to an Update instance',
             bot=bot
         )
 
         return ERROR_RESPONSE
 
+    user_id = update.effective_user.id
+
+    # Commands which don't use user data and conversations don't need them
+    stateful = not is_stateless_update(update)
+
     # Load user data from the database
-    dispatcher.load_persistence_data(
-        user_id=update.effective_user.id
-    )
+    if stateful:
+        dispatcher.load_persistence_data(
+            user_id=user_id
+        )
 
     # Process received update.
     # In case of error it would be handled by handlers.on_error function
     dispatcher.process_update(update)
 
-    unknown_update = dispatcher.user_data.get(
-        update.effective_user.id, {}
-    ).pop('UNKNOWN', False)
+    # Look up user data once to take both flags from it
+    user_data = dispatcher.user_data.get(user_id)
+
+    if user_data is None:
+        unknown_update = False
+        error_update = False
     
-    error_update = dispatcher.user_data.get(
-        update.effective_user.id, {}
-    ).pop('ERROR', False)
+    else:
+        unknown_update = user_data.pop('UNKNOWN', False)
+        error_update = user_data.pop('ERROR', False)
 
     # Update persistence so we don't save these values in the database
     if unknown_update or error_update:
@@ -116,9 +139,10 @@ def process_update(event, context):
 
     # Save user data back to the database
     # or remove it from the database in case of error update
-    dispatcher.update_persistence_database(
-        user_id=update.effective_user.id,
-        error=error_update
-    )
+    if stateful or error_update:
+        dispatcher.update_persistence_database(
+            user_id=user_id,
+            error=error_update
+        )
 
     return OK_RESPONSE
@@ -1,5 +1,6 @@
 import logging
-import ujson as json
+import orjson
+import ydb
 from collections import defaultdict
 from database import ydb_client
 from telegram.ext import (
@@ -9,6 +10,7 @@ from telegram.ext import (
 from telegram.ext.callbackdatacache import CallbackDataCache
 from telegram.ext.conversationhandler import ConversationHandler
 from telegram.ext.handler import Handler
+from typing import Optional
 
 
 class PersistentDispatcher(Dispatcher):
@@ -18,6 +20,37 @@ class PersistentDispatcher(Dispatcher):
     with YDBPersistence
     """
 
+    def __init__(
+        self,
+        *args,
+        **kwargs
+        ):
+        super().__init__(*args, **kwargs)
+
+        # ConversationHandlers of all groups, collected once on adding handlers
+        # to restore and end conversations without scanning every handler
+        self.conversation_handlers = []
+
+        # Persistence type doesn't change, so check it once
+        self.ydb_persistence = self.persistence if isinstance(self.persistence, YDBPersistence) else None
+
+        # Store settings don't change either, so choose what to load once
+        self.persistence_loaders = []
+
+        if self.persistence is not None:
+            if self.persistence.store_user_data:
+                self.persistence_loaders.append(self.load_user_data)
+
+            if self.persistence.store_chat_data:
+                self.persistence_loaders.append(self.load_chat_data)
+
+            if self.persistence.store_bot_data:
+                self.persistence_loaders.append(self.load_bot_data)
+
+            if self.persistence.store_callback_data:
+                self.persistence_loaders.append(self.load_callback_data)
+
+
     def add_handler(
         self,
         handler: Handler,
@@ -29,7 +62,10 @@ class PersistentDispatcher(Dispatcher):
 
         super().add_handler(handler, **kwargs)
 
-        if isinstance(self.persistence, YDBPersistence) and isinstance(handler, ConversationHandler):
+        if isinstance(handler, ConversationHandler):
+            self.conversation_handlers.append(handler)
+
+        if (self.ydb_persistence is not None) and isinstance(handler, ConversationHandler):
             # per_user=True since data in YDBPersistence is stored per user
             if not handler.per_user:
                 raise ValueError('YDBPersistence requires per_user=True for ConversationHandler')
@@ -48,6 +84,59 @@ class PersistentDispatcher(Dispatcher):
                 raise ValueError('ConversationHandler is not persistent')
 
 
+    def load_user_data(self) -> None:
+        """
+        Load user data from persistence
+        """
+
+        self.user_data = self.persistence.get_user_data()
+
+        if not isinstance(self.user_data, defaultdict):
+            raise ValueError('user_data must be of type defaultdict')
+
+
+    def load_chat_data(self) -> None:
+        """
+        Load chat data from persistence
+        """
+
+        self.chat_data = self.persistence.get_chat_data()
+
+        if not isinstance(self.chat_data, defaultdict):
+            raise ValueError('chat_data must be of type defaultdict')
+
+
+    def load_bot_data(self) -> None:
+        """
+        Load bot data from persistence
+        """
+
+        self.bot_data = self.persistence.get_bot_data()
+
+        if not isinstance(self.bot_data, self.context_types.bot_data):
+            raise ValueError(
+                f'bot_data must be of type {self.context_types.bot_data.__name__}'
+            )
+
+
+    def load_callback_data(self) -> None:
+        """
+        Load callback data from persistence
+        """
+
+        persistent_data = self.persistence.get_callback_data()
+
+        if persistent_data is not None:
+            if not isinstance(persistent_data, tuple) and len(persistent_data) != 2:
+                raise ValueError('callback_data must be a 2-tuple')
+            
+            self.bot.callback_data_cache = CallbackDataCache(
+                self.bot,
+                self.bot.callback_data_cache.maxsize,
+                persistent_data=persistent_data
+            )
+
+
     def load_persistence_data(
         self,
         user_id: int
@@ -61,51 +150,24 @@ class PersistentDispatcher(Dispatcher):
         if self.persistence is None:
             return None
         
-        elif isinstance(self.persistence, YDBPersistence):
+        elif self.ydb_persistence is not None:
             # Update persistence dictionaries first
-            self.persistence.update_data(
+            self.ydb_persistence.update_data(
                 user_id=user_id,
-                data=self.persistence.get_data(user_id=user_id)
+                data=self.ydb_persistence.get_data(user_id=user_id)
             )
 
-        if self.persistence.store_user_data:
-            self.user_data = self.persistence.get_user_data()
-
-            if not isinstance(self.user_data, defaultdict):
-                raise ValueError('user_data must be of type defaultdict')
-
-        if self.persistence.store_chat_data:
-            self.chat_data = self.persistence.get_chat_data()
-
-            if not isinstance(self.chat_data, defaultdict):
-                raise ValueError('chat_data must be of type defaultdict')
-
-        if self.persistence.store_bot_data:
-            self.bot_data = self.persistence.get_bot_data()
-
-            if not isinstance(self.bot_data, self.context_types.bot_data):
-                raise ValueError(
-                    f'bot_data must be of type {self.context_types.bot_data.__name__}'
-                )
-        
-        if self.persistence.store_callback_data:
-            persistent_data = self.persistence.get_callback_data()
-
-            if persistent_data is not None:
-                if not isinstance(persistent_data, tuple) and len(persistent_data) != 2:
-                    raise ValueError('callback_data must be a 2-tuple')
-                
-                self.bot.callback_data_cache = CallbackDataCache(
-                    self.bot,
-                    self.bot.callback_data_cache.maxsize,
-                    persistent_data=persistent_data
-                )
+        for load in self.persistence_loaders:
+            load()
         
         # Conversations are stored at corresponding handlers
-        for group in self.groups:
-            for handler in self.handlers[group]:
-                if isinstance(handler, ConversationHandler) and handler.persistent:
-                    handler.conversations = self.persistence.get_conversations(handler.name)
+        for handler in self.conversation_handlers:
+            if handler.persistent:
+                handler.conversations = self.persistence.get_conversations(handler.name)
+
+        # Remember the loaded data to skip saving it back unchanged
+        if self.ydb_persistence is not None:
+            self.ydb_persistence.remember_data(user_id=user_id)
 
     
     def update_persistence_database(
@@ -121,8 +183,8 @@ class PersistentDispatcher(Dispatcher):
         if self.persistence is None:
             return None
         
-        elif isinstance(self.persistence, YDBPersistence):
-            self.persistence.update_database(
+        elif self.ydb_persistence is not None:
+            self.ydb_persistence.update_database(
                 user_id=user_id,
                 error=error
             )
@@ -135,13 +197,11 @@ class PersistentDispatcher(Dispatcher):
         End all conversations for the user in the specified update
         """
 
-        for group in self.groups:
-            for handler in self.handlers[group]:
-                if isinstance(handler, ConversationHandler):
-                    handler._update_state(
-                        new_state=handler.END, 
-                        key=handler._get_key(update)
-                    )
+        for handler in self.conversation_handlers:
+            handler._update_state(
+                new_state=handler.END, 
+                key=handler._get_key(update)
+            )
 
 
 class YDBPersistence(DictPersistence):
@@ -152,6 +212,19 @@ class YDBPersistence(DictPersistence):
     Uses the global variable ydb_client with connection to Yandex Database
     """
 
+    # PTB persistence classes keep __dict__ for their wrapped methods,
+    # but own attributes read on every update are still stored in slots
+    __slots__ = (
+        'users_table',
+        'user_id_column',
+        'data_column',
+        'meetings_ts_column',
+        'loaded_dumps',
+        'get_query',
+        'update_query',
+        'clear_query'
+    )
+
     def __init__(
         self,
         **kwargs
@@ -160,6 +233,51 @@ class YDBPersistence(DictPersistence):
         self.user_id_column = ydb_client.user_id_column
         self.data_column = ydb_client.data_column
         self.meetings_ts_column = ydb_client.meetings_ts_column
+        # Data of users as it was loaded from the database, dumped into JSON
+        self.loaded_dumps = {}
+
+        # Table and columns don't change, so build the queries once.
+        # Queries with declared parameters types don't need preparing
+        self.get_query = ydb.DataQuery(
+            f"""
+                DECLARE $user_id AS Uint64;
+
+                SELECT {self.data_column}
+                FROM {self.users_table}
+                WHERE {self.user_id_column} = $user_id
+            """,
+            {
+                '$user_id': ydb.PrimitiveType.Uint64
+            }
+        )
+
+        self.update_query = ydb.DataQuery(
+            f"""
+                DECLARE $user_id AS Uint64;
+                DECLARE $data AS Optional<Json>;
+
+                UPDATE {self.users_table}
+                SET {self.data_column} = $data
+                WHERE {self.user_id_column} = $user_id
+            """,
+            {
+                '$user_id': ydb.PrimitiveType.Uint64,
+                '$data': ydb.OptionalType(ydb.PrimitiveType.Json)
+            }
+        )
+
+        self.clear_query = ydb.DataQuery(
+            f"""
+                DECLARE $user_id AS Uint64;
+
+                UPDATE {self.users_table}
+                SET {self.data_column} = NULL, {self.meetings_ts_column} = NULL
+                WHERE {self.user_id_column} = $user_id
+            """,
+            {
+                '$user_id': ydb.PrimitiveType.Uint64
+            }
+        )
 
         super().__init__(
             store_user_data=True,
@@ -178,42 +296,21 @@ class YDBPersistence(DictPersistence):
         Get persistent data for the specified user from the database
         """
 
-        declarations = 'DECLARE $user_id AS Uint64;'
-
-        query = f"""
-            {declarations}
-            
-            SELECT {self.data_column}
-            FROM {self.users_table}
-            WHERE {self.user_id_column} = $user_id
-        """
-
-        parameters={
-            '$user_id': user_id,
-        }
-
-        result_sets = ydb_client.execute_query(
-            query=query,
-            parameters=parameters
+        # User id is the primary key, so there is at most one row
+        cell = ydb_client.fetch_scalar(
+            query=self.get_query,
+            parameters={
+                '$user_id': user_id
+            },
+            column=self.data_column
         )
 
-        result_set = result_sets[0]
-
-        if len(result_set.rows) < 1:
-            cell = None
-        
-        elif len(result_set.rows) == 1:
-            cell = getattr(result_set.rows[0], self.data_column)
-
-        else:
-            raise LookupError(f'Table {self.users_table} has more than 1 row for user id {user_id}')
-
         if cell is None:
             return {}
         
         else:
             # self.data_column is either None or a valid JSON
-            return json.loads(cell)
+            return orjson.loads(cell)
     
 
     def update_data(
@@ -225,14 +322,17 @@ class YDBPersistence(DictPersistence):
         Update persistence dictionaries for the specified user with provided data
         """
 
-        if data.get('user_data') is not None:
+        user_data = data.get('user_data')
+        conversations = data.get('conversations')
+
+        if user_data is not None:
             self.update_user_data(
                 user_id=user_id,
-                data=data.get('user_data')
+                data=user_data
             )
         
-        if data.get('conversations') is not None:
-            for conv_name, state in data.get('conversations').items():
+        if conversations is not None:
+            for conv_name, state in conversations.items():
                 self.update_conversation(
                     name=conv_name,
                     key=(user_id,),
@@ -243,10 +343,11 @@ class YDBPersistence(DictPersistence):
     def _dump_into_json(
         self,
         user_id: int
-        ) -> str:
+        ) -> Optional[str]:
         """
         Dumps data for the specified user into JSON format for inserting into the database.
-        Key with user_id is omitted, since it's already present in the database
+        Key with user_id is omitted, since it's already present in the database.
+        Returns None if there is no data to save
         """
 
         to_dump = {}
@@ -255,9 +356,7 @@ class YDBPersistence(DictPersistence):
             user_data = self.user_data.get(user_id)
 
             if user_data is not None:
-                to_dump.update({
-                    'user_data': user_data
-                })
+                to_dump['user_data'] = user_data
         
         if self.conversations is not None:
             # filter every conversation for this user_id
@@ -268,14 +367,34 @@ class YDBPersistence(DictPersistence):
                 state = conv_data.get((user_id,))
 
                 if state is not None:
-                    conversations_data.update({conv_name: state})
+                    conversations_data[conv_name] = state
             
             if conversations_data:
-                to_dump.update({
-                    'conversations': conversations_data
-                })
+                to_dump['conversations'] = conversations_data
 
-        return json.dumps(to_dump)
+        # Save no data as NULL without dumping it
+        if not to_dump:
+            return None
+
+        # Keys which are not strings are dumped as strings, as ujson did.
+        # The driver sends Json parameters as text, so decode the bytes
+        return orjson.dumps(
+            to_dump,
+            option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+
+    def remember_data(
+        self,
+        user_id: int
+        ) -> None:
+        """
+        Remember current data for the specified user as loaded from the database
+        """
+
+        self.loaded_dumps[user_id] = self._dump_into_json(
+            user_id=user_id
+        )
 
 
     def update_database(
@@ -287,7 +406,7 @@ class YDBPersistence(DictPersistence):
         Save or remove data for the specified user in the database
         """
 
-        declarations = 'DECLARE $user_id AS Uint64;'
+        loaded_dump = self.loaded_dumps.pop(user_id, None)
 
         parameters = {
             '$user_id': user_id
@@ -295,31 +414,19 @@ class YDBPersistence(DictPersistence):
 
         # Remove persistence and meetings data on error
         if error:
-            query = f"""
-                {declarations}
-                
-                UPDATE {self.users_table}
-                SET {self.data_column} = NULL, {self.meetings_ts_column} = NULL
-                WHERE {self.user_id_column} = $user_id
-            """
+            query = self.clear_query
         
         # Dump and save otherwise
         else:
-            declarations += ' DECLARE $data AS Json;'
-
-            data = '$data'
-
             parameters['$data'] = self._dump_into_json(
                 user_id=user_id
             )
 
-            query = f"""
-                {declarations}
-                
-                UPDATE {self.users_table}
-                SET {self.data_column} = {data}
-                WHERE {self.user_id_column} = $user_id
-            """
+            # Most updates don't change the data, so don't write it back
+            if parameters['$data'] == loaded_dump:
+                return None
+
+            query = self.update_query
 
         ydb_client.execute_query(
             query=query,
@@ -75,7 +75,7 @@ camps_data = [
     ('Экоголики', 'https://telegra.ph/EHkogoliki-02-19')
 ]
 
-memes_data = [
+memes_data = (
     ('PHOTO', 'AgACAgIAAxkBAAIHMWITjoOSwH7r2XspFve4WPVvpODUAAK1tzEb7xyZSBAj1xcH-4_0AQADAgADcwADIwQ', 'С этим сложно поспорить, конечно!'),
     ('PHOTO', 'AgACAgIAAxkBAAIHM2ITjqeHen2FRVPbrGWkXdT-I82WAAK2tzEb7xyZSLD4j7lKk8XlAQADAgADcwADIwQ', 'Просто мы купили нативную рекламу…'),
     ('PHOTO', 'AgACAgIAAxkBAAIHNWITjtvP75l1x2yRCT8JDJ3VKC47AAK3tzEb7xyZSIcT6a0Z5dAsAQADAgADcwADIwQ', 'Про это шутить не будем, пожалуй'),
@@ -111,7 +111,7 @@ memes_data = [
     ('ANIMATION', 'CgACAgQAAxkBAAIHmmIT8BvQlem_9ermLyM3IMkcqllLAALlAgACf4G9Ug6039zwNz2DIwQ', ''),
     ('ANIMATION', 'CgACAgQAAxkBAAIHmmIT8BvQlem_9ermLyM3IMkcqllLAALlAgACf4G9Ug6039zwNz2DIwQ', ''),
     ('ANIMATION', 'CgACAgQAAxkBAAIHnGIT8EYxeiTrw65VuZ6pUIHYdpFbAAIVAwACqa-0UqhZXrayzsxsIwQ', 'У нас радостно!'),
-]
+)
 
 principles_description = (
     '<b>Принципы, по которым живёт наше сообщество</b>:\n\n'
@@ -128,7 +128,7 @@ principles_description = (
     'Помнишь, что означает каждый из них?'
 )
 
-principles_data = [
+principles_data = (
     '1. <b>Радикальное включение</b>\n\n'
     'Радикальное включение значит, что любой человек может стать частью сообщества Russian Burners. '
     'Мы делаем мероприятия, где у каждого есть шанс найти себя и своих единомышленников. На них становятся не важны ваши политические взгляды, '
@@ -215,4 +215,4 @@ principles_data = [
     'Immediate experience is, in many ways, the most important touchstone of value in our culture. We seek to overcome barriers that stand '
     'between us and a recognition of our inner selves, the reality of those around us, participation in society, and contact with a natural '
     'world exceeding human powers. No idea can substitute for this experience.'
-]
+)